@@ -1,59 +1,250 @@
+import time
+_import_started = time.perf_counter()
+
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash
+from datetime import datetime
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import login_required, current_user, login_user, logout_user
-from db_models import db, User, UserProfile, Round
-from auth import init_auth
+from db_models import db, UserProfile, Round, Group, GroupMember, ProvisionJob
+from auth import init_auth, admin_required
+from rollups import get_group_rollup
+from profiling import init_profiling
+from sharding import configure_shards, find_user_by_email, register_user
+from resilience import (configure_database_timeouts, init_resilience, call_database, DatabaseUnavailable,
+                        snapshots, schedule_revalidation, get_spool, PlayerSnapshot)
+from projection import get_projection, refresh_after_round, PlayerVersion, MIN_ROUNDS as PROJECTION_MIN_ROUNDS
+from round_views import RoundView, recent_rounds
 from utils import validate_round_scores, get_level_info
 
-app = Flask(__name__)
+bp = Blueprint('main', __name__)
 
-# Configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
-# Handle DATABASE_URL - replace postgresql:// with postgresql+psycopg:// for Supabase compatibility
-database_url = os.environ.get('DATABASE_URL', 'postgresql+psycopg://localhost:5432/learntogolf_dev')
-if database_url.startswith('postgresql://'):
-    database_url = database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
+def create_app(config=None):
+    """Create and configure the Flask app.
+    
+    Nothing here touches the database, so the app can be built in the
+    gunicorn master with --preload and workers start serving immediately.
+    Schema changes are applied by `python init_db.py migrate` at deploy time.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    
+    # Configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    
+    # Handle DATABASE_URL - replace postgresql:// with postgresql+psycopg:// for Supabase compatibility
+    database_url = os.environ.get('DATABASE_URL', 'postgresql+psycopg://localhost:5432/learntogolf_dev')
+    if database_url.startswith('postgresql://'):
+        database_url = database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Drop connections the database closed while the machine was stopped
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+    
+    # Comma-separated list of emails allowed to use /admin routes
+    app.config['ADMIN_EMAILS'] = {
+        email.strip().lower()
+        for email in os.environ.get('ADMIN_EMAILS', '').split(',')
+        if email.strip()
+    }
+    
+    # On-demand profiling (see profiling.py); no hooks are installed unless enabled
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+    app.config['PROFILING_DIR'] = os.environ.get('PROFILING_DIR', 'profiles')
+    app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+    app.config['PROFILING_SQL_THRESHOLD_MS'] = float(os.environ.get('PROFILING_SQL_THRESHOLD_MS', '50'))
+    app.config['PROFILING_MAX_PROFILES'] = int(os.environ.get('PROFILING_MAX_PROFILES', '200'))
+    app.config['PROFILING_MAX_AGE_HOURS'] = float(os.environ.get('PROFILING_MAX_AGE_HOURS', '72'))
+    
+    # Optional warmup after start (see warm_templates / warm_database)
+    app.config['WARMUP_ENABLED'] = os.environ.get('WARMUP', '').lower() in ('1', 'true', 'yes')
+    app.config['WARMUP_CONNECTIONS'] = int(os.environ.get('WARMUP_CONNECTIONS', '2'))
+    
+    # Fail fast when the database is slow (see resilience.py)
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '3000'))
+    app.config['DB_CONNECT_TIMEOUT'] = int(os.environ.get('DB_CONNECT_TIMEOUT', '3'))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', '3'))
+    app.config['DB_BREAKER_FAILURES'] = int(os.environ.get('DB_BREAKER_FAILURES', '3'))
+    app.config['DB_BREAKER_RESET_SECONDS'] = float(os.environ.get('DB_BREAKER_RESET_SECONDS', '15'))
+    # Score submissions made while the database is down wait here
+    app.config['SPOOL_PATH'] = os.environ.get('SPOOL_PATH', os.path.join('spool', 'scores.sqlite3'))
+    
+    if config:
+        app.config.update(config)
+    
+    # Extra databases for per-user tables (see sharding.py)
+    configure_shards(app)
+    configure_database_timeouts(app)
+    
+    # Initialize extensions
+    db.init_app(app)
+    init_auth(app)
+    init_resilience(app)
+    init_profiling(app)
+    
+    app.register_blueprint(bp)
+    
+    app.config['STARTUP_TIMINGS'] = {
+        'imports_ms': round((started - _import_started) * 1000, 1),
+        'create_app_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    _track_first_request(app)
+    return app
 
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Initialize extensions
-db.init_app(app)
-init_auth(app)
+def warm_templates(app):
+    """Compile every template into the Jinja cache.
+    
+    Safe to run in the gunicorn master before forking, so workers share
+    the compiled templates.
+    """
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    app.config['STARTUP_TIMINGS']['templates_ms'] = round((time.perf_counter() - started) * 1000, 1)
 
-# Auto-initialize database tables in production
-with app.app_context():
-    try:
-        db.create_all()
-        print("Database tables initialized successfully")
-    except Exception as e:
-        print(f"Database initialization warning: {e}")
-        # Don't fail startup if tables already exist
 
-@app.route('/')
-def index():
-    # If user is not authenticated, show welcome page
-    if not current_user.is_authenticated:
-        return render_template('welcome.html')
+def warm_database(app):
+    """Open pool connections on every shard so first requests skip connect and TLS setup.
     
-    # Get or create user profile
-    profile = current_user.profile
+    Run in each worker after forking; connections must never be shared
+    across processes.
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            connections = []
+            try:
+                for _ in range(app.config['WARMUP_CONNECTIONS']):
+                    connection = engine.connect()
+                    connection.exec_driver_sql('SELECT 1')
+                    connections.append(connection)
+            except Exception as e:
+                # A slow or unreachable database must not stop the worker booting
+                print(f"Database warmup warning ({bind or 'default'}): {e}")
+            finally:
+                for connection in connections:
+                    connection.close()
+    app.config['STARTUP_TIMINGS']['database_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def _track_first_request(app):
+    """Log how long after process start the first response was ready."""
+    state = {'pending': True}
+    
+    @app.after_request
+    def report_first_request(response):
+        if state['pending']:
+            state['pending'] = False
+            timings = app.config['STARTUP_TIMINGS']
+            # Under gunicorn, time from the master's start (see gunicorn.conf.py); else this process
+            process_started = _process_started_at(os.environ.get('APP_MASTER_PID', 'self'))
+            timings['first_response_s'] = round(time.time() - process_started, 3)
+            print(f"Startup timings: {timings}")
+        return response
+
+
+def _process_started_at(pid='self'):
+    """Wall-clock time a process started, from /proc when available."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time() - (time.perf_counter() - _import_started)
+
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness check that never touches the database."""
+    return jsonify({'status': 'ok', 'startup': current_app.config['STARTUP_TIMINGS']})
+
+
+def _get_or_create_profile(user_id):
+    profile = UserProfile.query.filter_by(user_id=user_id).first()
     if not profile:
-        profile = UserProfile(user_id=current_user.id)
+        profile = UserProfile(user_id=user_id)
         db.session.add(profile)
         db.session.commit()
+    return profile
+
+
+def progress_context(user_id):
+    """Level, rounds at this level and level-up projection, as plain data."""
+    profile = _get_or_create_profile(user_id)
+    return {
+        'player': PlayerSnapshot(user_id, profile.current_level, profile.total_rounds,
+                                 profile.get_rounds_at_current_level()),
+        'level_info': get_level_info(profile.current_level),
+        'projection': get_projection(profile),
+        'projection_min_rounds': PROJECTION_MIN_ROUNDS,
+    }
+
+
+def history_context(user_id):
+    """The last ten rounds, as plain data."""
+    _get_or_create_profile(user_id)
+    return {'recent_rounds': recent_rounds(user_id, 10)}
+
+
+def stats_context(user_id):
+    """Lifetime statistics for the stats panel."""
+    profile = _get_or_create_profile(user_id)
+    
+    # Calculate statistics
+    par_or_better_count = Round.query.filter_by(user_id=user_id).filter(Round.total <= 36).count()
+    level_ups = Round.query.filter_by(user_id=user_id, leveled_up=True).count()
+    
+    return {'stats': {
+        'total_rounds': profile.total_rounds,
+        'average_score': profile.get_average_score(),
+        'best_score': profile.get_best_score(),
+        'current_level': profile.current_level,
+        'rounds_at_current_level': profile.get_rounds_at_current_level(),
+        'par_or_better_count': par_or_better_count,
+        'level_ups': level_ups
+    }}
+
+
+def render_section(section, template, builder, refresh_target, refresh_swap='innerHTML',
+                   unavailable_template='offline_section.html'):
+    """Render live data, or the user's last snapshot if the database is unavailable.
+    
+    A stale snapshot is shown with a "last updated" marker that polls for
+    fresh data into refresh_target, while the background worker revalidates it.
+    """
+    user_id = current_user.id
+    refresh = {'refresh_url': request.path if section != 'progress' else '/progress',
+               'refresh_target': refresh_target, 'refresh_swap': refresh_swap}
+    try:
+        context = call_database(builder, user_id)
+    except DatabaseUnavailable:
+        schedule_revalidation(current_app._get_current_object(), user_id, section, builder)
+        snapshot = snapshots.get(user_id, section)
+        pending_rounds = get_spool().pending_count(user_id)
+        if snapshot is None:
+            # 200 so HTMX swaps the notice in and keeps polling, and the score form still works
+            return render_template(unavailable_template, pending_rounds=pending_rounds, **refresh)
+        return render_template(template, stale_since=snapshot.updated_at,
+                               pending_rounds=pending_rounds, **refresh, **snapshot.context)
     
-    # Get data for dashboard
-    level_info = get_level_info(profile.current_level)
-    recent_rounds = profile.get_recent_rounds(5)
+    snapshots.save(user_id, section, context)
+    return render_template(template, **context)
+
+
+@bp.route('/')
+def index():
+    # If user is not authenticated, show welcome page
+    if not current_user.is_authenticated:
+        return render_template('welcome.html')
     
-    return render_template('index.html', 
-                         player=profile, 
-                         level_info=level_info,
-                         recent_rounds=recent_rounds)
+    return render_section('progress', 'index.html', progress_context, '#progress-section', 'outerHTML',
+                          unavailable_template='index.html')
 
-@app.route('/score', methods=['POST'])
+@bp.route('/score', methods=['POST'])
 @login_required
 def submit_score():
     try:
@@ -97,9 +288,30 @@ def submit_score():
             </div>
             '''.format(message), 400
         
-        # Get user profile
-        profile = current_user.profile
-        if not profile:
+        user_id = current_user.id
+        spool = get_spool()
+        # One timestamp for the round wherever it is stored, so replaying a spooled
+        # round that did reach the database recognises it
+        played_at = datetime.utcnow()
+        
+        # Rounds already waiting in the spool are recorded first, so order is kept
+        spooled = bool(spool.pending_count(user_id))
+        if not spooled:
+            try:
+                player, round_view = call_database(_record_round, user_id, holes, played_at)
+            except DatabaseUnavailable:
+                spooled = True
+        
+        if spooled:
+            spool.append(user_id, holes, played_at)
+            return '''
+            <div class="p-4 rounded-lg bg-gray-50 border-l-4 border-blue-500">
+                <p class="font-semibold text-blue-600">Round saved</p>
+                <p class="text-sm text-gray-500 mt-1">We're having trouble reaching the server, so your round was saved and will be recorded automatically.</p>
+            </div>
+            ''', 202
+        
+        if round_view is None:
             return '''
             <div class="p-4 rounded-lg bg-red-50 border-l-4 border-red-500">
                 <p class="font-semibold text-red-600">Profile Error</p>
@@ -107,21 +319,21 @@ def submit_score():
             </div>
             ''', 500
         
-        # Add the round to the user's profile
-        round_obj = profile.add_round(holes)
+        # Outside call_database: the round is committed whatever happens here
+        refresh_after_round(player)
         
         # Generate success message
-        if round_obj.leveled_up and profile.current_level > round_obj.level:
-            message = f'Congratulations! You shot {round_obj.total} and leveled up to Level {profile.current_level}!'
-        elif round_obj.total <= 36:
-            message = f'Great round! You shot {round_obj.total} (Par or better).'
+        if round_view.leveled_up and player.current_level > round_view.level:
+            message = f'Congratulations! You shot {round_view.total} and leveled up to Level {player.current_level}!'
+        elif round_view.total <= 36:
+            message = f'Great round! You shot {round_view.total} (Par or better).'
         else:
-            message = f'Round completed with a score of {round_obj.total}. Keep practicing!'
+            message = f'Round completed with a score of {round_view.total}. Keep practicing!'
         
         # Return HTML response for HTMX
-        success_class = "text-green-600" if round_obj.total <= 36 else "text-blue-600"
+        success_class = "text-green-600" if round_view.total <= 36 else "text-blue-600"
         level_up_badge = ""
-        if round_obj.leveled_up and profile.current_level > round_obj.level:
+        if round_view.leveled_up and player.current_level > round_view.level:
             level_up_badge = f'<span class="inline-block bg-yellow-100 text-yellow-800 text-xs px-2 py-1 rounded-full ml-2">Level Up!</span>'
         
         return f'''
@@ -140,51 +352,63 @@ def submit_score():
         </div>
         ''', 500
 
-@app.route('/progress')
+def _record_round(user_id, holes, played_at):
+    """Add a round for a user. Returns (PlayerVersion, RoundView), or (None, None) without a profile.
+    
+    Everything the response needs is read here, inside call_database: the
+    commit in add_round expires the profile and Round, and reloading them
+    afterwards could fail after the round is already stored.
+    """
+    profile = UserProfile.query.filter_by(user_id=user_id).first()
+    if not profile:
+        return None, None
+    level = profile.current_level
+    total = sum(holes)
+    profile.add_round(holes, played_at=played_at)
+    player = PlayerVersion(user_id, profile.current_level, profile.total_rounds)
+    return player, RoundView(level, total, total <= 36, played_at, holes)
+
+@bp.route('/progress')
 @login_required
 def get_progress():
-    profile = current_user.profile
-    level_info = get_level_info(profile.current_level)
-    recent_rounds = profile.get_recent_rounds(5)
-    
-    return render_template('progress_section.html', 
-                         player=profile, 
-                         level_info=level_info,
-                         recent_rounds=recent_rounds)
+    return render_section('progress', 'progress_section.html', progress_context, '#progress-section', 'outerHTML')
 
-@app.route('/history')
+@bp.route('/history')
 @login_required
 def get_history():
-    profile = current_user.profile
-    recent_rounds = profile.get_recent_rounds(10)
-    
-    return render_template('history_section.html', 
-                         player=profile,
-                         recent_rounds=recent_rounds)
+    return render_section('history', 'history_section.html', history_context, '#history-section')
 
-@app.route('/stats')
+@bp.route('/stats')
 @login_required
 def get_stats():
-    profile = current_user.profile
+    return render_section('stats', 'stats_section.html', stats_context, '#stats-section')
+
+
+@bp.route('/groups')
+@login_required
+def list_groups():
+    """Groups the current user coaches."""
+    groups = Group.query.join(GroupMember)\
+                        .filter(GroupMember.user_id == current_user.id, GroupMember.role == 'coach')\
+                        .order_by(Group.name).all()
     
-    # Calculate statistics
-    par_or_better_count = Round.query.filter_by(user_id=current_user.id).filter(Round.total <= 36).count()
-    level_ups = Round.query.filter_by(user_id=current_user.id, leveled_up=True).count()
+    return render_template('groups.html', groups=groups)
+
+
+@bp.route('/groups/<int:group_id>')
+@login_required
+def group_dashboard(group_id):
+    """Coach dashboard for a single group."""
+    group = db.get_or_404(Group, group_id)
+    if not group.is_coach(current_user.id):
+        abort(403)
     
-    stats = {
-        'total_rounds': profile.total_rounds,
-        'average_score': profile.get_average_score(),
-        'best_score': profile.get_best_score(),
-        'current_level': profile.current_level,
-        'rounds_at_current_level': profile.get_rounds_at_current_level(),
-        'par_or_better_count': par_or_better_count,
-        'level_ups': level_ups
-    }
+    rollup = get_group_rollup(group)
     
-    return render_template('stats_section.html', stats=stats)
+    return render_template('group_dashboard.html', group=group, rollup=rollup)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """User login page."""
     if request.method == 'POST':
@@ -195,11 +419,11 @@ def login():
             flash('Please enter both email and password.', 'error')
             return render_template('login.html')
         
-        user = User.query.filter_by(email=email).first()
+        user = find_user_by_email(email)
         
         if user and user.check_password(password):
             login_user(user)
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Invalid email or password.', 'error')
             return render_template('login.html')
@@ -207,7 +431,7 @@ def login():
     return render_template('login.html')
 
 
-@app.route('/register', methods=['GET', 'POST'])  
+@bp.route('/register', methods=['GET', 'POST'])  
 def register():
     """User registration page."""
     if request.method == 'POST':
@@ -228,27 +452,17 @@ def register():
             flash('Password must be at least 6 characters long.', 'error')
             return render_template('register.html')
         
-        # Check if user already exists
-        if User.query.filter_by(email=email).first():
-            flash('An account with this email already exists.', 'error')
-            return render_template('register.html')
-        
         try:
-            # Create new user
-            user = User(email=email)
-            user.set_password(password)
-            db.session.add(user)
-            db.session.commit()
-            
-            # Create user profile
-            profile = UserProfile(user_id=user.id)
-            db.session.add(profile)
-            db.session.commit()
+            # Create the directory entry, user and profile; None if the email is taken
+            user = register_user(email, password)
+            if user is None:
+                flash('An account with this email already exists.', 'error')
+                return render_template('register.html')
             
             # Log in the user
             login_user(user)
             flash('Account created successfully! Welcome to Learn to Golf Tracker.', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
             
         except Exception as e:
             db.session.rollback()
@@ -258,16 +472,65 @@ def register():
     return render_template('register.html')
 
 
-@app.route('/logout')
+@bp.route('/admin/provision', methods=['POST'])
+@login_required
+@admin_required
+def admin_provision():
+    """Queue bulk creation of student accounts from an uploaded CSV."""
+    # Imported here to keep the provisioning machinery out of startup
+    from provisioning import read_students_csv, active_provision_job, start_provision_job, provision_job_status
+    
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'Upload a CSV file in the "file" field.'}), 400
+    
+    students, errors = read_students_csv(upload.read())
+    if not students:
+        return jsonify({'error': 'No students to provision.', 'errors': errors}), 400
+    
+    try:
+        batch_size = int(request.form.get('batch_size', 500))
+    except ValueError:
+        return jsonify({'error': 'batch_size must be a number.'}), 400
+    
+    running = active_provision_job()
+    if running is not None:
+        return jsonify({'error': 'Another provisioning job is still running.',
+                        'status_url': url_for('main.admin_provision_status', job_id=running.id)}), 409
+    
+    # Hashing takes minutes for a large academy, so it runs outside this request
+    job = start_provision_job(students, batch_size=max(1, batch_size), created_by=current_user.id)
+    status = provision_job_status(job)
+    status['errors'] = errors
+    status['status_url'] = url_for('main.admin_provision_status', job_id=job.id)
+    return jsonify(status), 202
+
+
+@bp.route('/admin/provision/<int:job_id>')
+@login_required
+@admin_required
+def admin_provision_status(job_id):
+    """Progress of a provisioning job, with its report and invite tokens once done."""
+    from provisioning import provision_job_status
+    
+    job = db.session.get(ProvisionJob, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(provision_job_status(job))
+
+
+@bp.route('/logout')
 @login_required
 def logout():
     """Log out the current user."""
     logout_user()
     flash('You have been logged out successfully.', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
+
 
+app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,7 +1,11 @@
 """Authentication configuration and utilities for Learn to Golf Tracker."""
 
-from flask_login import LoginManager
+from functools import wraps
+from flask import abort, current_app
+from flask_login import LoginManager, current_user
 from db_models import User
+from sharding import route_to_user
+from resilience import call_database, DatabaseUnavailable, OfflineUser, snapshots
 
 
 def init_auth(app):
@@ -10,13 +14,46 @@ def init_auth(app):
     login_manager.init_app(app)
     
     # Configure login view
-    login_manager.login_view = 'login'
+    login_manager.login_view = 'main.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
     @login_manager.user_loader
     def load_user(user_id):
-        """Load user by ID for Flask-Login."""
-        return User.query.get(int(user_id))
+        """Load user by ID for Flask-Login, from the shard that holds it.
+        
+        While the database is unavailable the session stays logged in as an
+        OfflineUser, so snapshots and the score spool keep working.
+        """
+        user_id = int(user_id)
+        try:
+            user = call_database(_load_user, user_id)
+        except DatabaseUnavailable:
+            account = snapshots.get(user_id, 'account')
+            return OfflineUser(user_id, account.context['email'] if account else '')
+        if user is not None:
+            snapshots.save(user_id, 'account', {'email': user.email})
+        return user
     
-    return login_manager
\ No newline at end of file
+    return login_manager
+
+def _load_user(user_id):
+    if route_to_user(user_id) is None:
+        return None
+    return User.query.get(user_id)
+
+def is_admin(user):
+    """Check whether a user is listed in the ADMIN_EMAILS config."""
+    if not user.is_authenticated:
+        return False
+    return user.email in current_app.config.get('ADMIN_EMAILS', set())
+
+
+def admin_required(view):
+    """Restrict a view to logged-in admins."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
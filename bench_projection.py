@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Benchmark the level-up projection simulation.
+
+Times building the per-hole distributions and simulating rounds for a
+synthetic player, without a database. Usage:
+
+    python bench_projection.py [--history 30] [--repeats 50]
+"""
+
+import argparse
+import statistics
+import time
+import numpy as np
+from projection import SIMULATED_ROUNDS, hole_distributions, simulate_totals, project
+
+
+def synthetic_history(rounds, seed=0):
+    """Rounds of 3-7 strokes per hole, newest first, like a player at a mid level."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(3, 8, size=(rounds, 9)).tolist()
+
+
+def time_ms(func, repeats):
+    func()  # warm up
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def run_benchmark(history=30, repeats=50):
+    rounds = synthetic_history(history)
+    probabilities = hole_distributions(rounds)
+    rng = np.random.default_rng(1)
+
+    results = {
+        'hole_distributions': time_ms(lambda: hole_distributions(rounds), repeats),
+    }
+    for n in (10_000, SIMULATED_ROUNDS, 1_000_000):
+        results[f'simulate {n:,} rounds'] = time_ms(lambda: simulate_totals(probabilities, n=n, rng=rng), repeats)
+    results['project (end to end)'] = time_ms(lambda: project(rounds, seed=1), repeats)
+
+    print(f"History: {history} rounds, {repeats} repeats")
+    print(f"  {'step':<28} {'min ms':>8} {'median ms':>10} {'p95 ms':>8}")
+    for name, timing in results.items():
+        print(f"  {name:<28} {timing['min']:>8.2f} {timing['median']:>10.2f} {timing['p95']:>8.2f}")
+
+    projection = project(rounds, seed=1)
+    print(f"Chance of 36 or better: {projection['par_or_better_chance']:.2%}, "
+          f"expected rounds to level up: {projection['expected_rounds']:.1f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the level-up projection simulation.')
+    parser.add_argument('--history', type=int, default=30, help='Rounds of history at the current level')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed runs per step')
+    args = parser.parse_args()
+
+    run_benchmark(history=args.history, repeats=args.repeats)
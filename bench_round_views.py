@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Benchmark the Core read path in round_views.py against loading Round objects.
+
+Creates a throwaway user with 10,000 rounds in the configured database,
+fetches their latest 10, 100 and 10,000 rounds both ways, reading every field
+the history template reads, then deletes the user. Usage:
+
+    python bench_round_views.py [--repeats 50]
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert
+from app import create_app
+from db_models import db, User, UserProfile, Round, UserDirectory
+from round_views import recent_rounds
+from sharding import register_user, route_to_user
+
+SIZES = (10, 100, 10_000)
+INSERT_BATCH_SIZE = 1000
+
+
+def orm_rounds(user_id, limit):
+    """The ORM path: Round objects, read the way the history template reads them."""
+    rounds = Round.query.filter_by(user_id=user_id)\
+                        .order_by(Round.played_at.desc())\
+                        .limit(limit).all()
+    for r in rounds:
+        r.level, r.total, r.leveled_up, r.played_at, r.get_holes_list()
+    return rounds
+
+
+def core_rounds(user_id, limit):
+    """The Core path used by the app: RoundView tuples."""
+    views = recent_rounds(user_id, limit)
+    for v in views:
+        v.level, v.total, v.leveled_up, v.played_at, v.holes
+    return views
+
+
+def measure(fetch, user_id, limit, repeats):
+    """Median and min milliseconds, plus peak and retained KiB for one fetch."""
+    timings = []
+    for _ in range(repeats + 1):
+        # A fresh session each time, like a new request
+        db.session.rollback()
+        db.session.expunge_all()
+        route_to_user(user_id)
+        started = time.perf_counter()
+        fetch(user_id, limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings = timings[1:]  # first run warms caches
+
+    db.session.rollback()
+    db.session.expunge_all()
+    route_to_user(user_id)
+    tracemalloc.start()
+    result = fetch(user_id, limit)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'peak_kib': peak / 1024,
+        'retained_kib': retained / 1024,
+    }
+
+
+def create_bench_user(rounds):
+    user = register_user(f'bench-{time.time_ns()}@example.com', 'benchmark')
+    started = datetime.utcnow() - timedelta(minutes=rounds)
+    rows = [
+        {'user_id': user.id, 'level': 1 + i % 6, 'holes': [4 + (i + h) % 3 for h in range(9)],
+         'total': 36 + sum((i + h) % 3 for h in range(9)), 'leveled_up': False,
+         'played_at': started + timedelta(minutes=i)}
+        for i in range(rounds)
+    ]
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(insert(Round), rows[start:start + INSERT_BATCH_SIZE])
+    db.session.commit()
+    return user.id
+
+
+def delete_bench_user(user_id):
+    db.session.rollback()
+    route_to_user(user_id)
+    db.session.execute(delete(Round).where(Round.user_id == user_id))
+    db.session.execute(delete(UserProfile).where(UserProfile.user_id == user_id))
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+    db.session.execute(delete(UserDirectory).where(UserDirectory.user_id == user_id))
+    db.session.commit()
+
+
+def run_benchmark(repeats=50):
+    app = create_app()
+    with app.app_context():
+        print(f"Creating a user with {max(SIZES):,} rounds...")
+        user_id = create_bench_user(max(SIZES))
+        try:
+            print(f"  {'rows':>6} {'path':<5} {'median ms':>10} {'min ms':>8} {'peak KiB':>10} {'kept KiB':>10}")
+            for size in SIZES:
+                # Keep the 10k case to a few seconds
+                size_repeats = max(3, repeats * 100 // max(size, 100))
+                for name, fetch in (('orm', orm_rounds), ('core', core_rounds)):
+                    m = measure(fetch, user_id, size, size_repeats)
+                    print(f"  {size:>6,} {name:<5} {m['median_ms']:>10.2f} {m['min_ms']:>8.2f} "
+                          f"{m['peak_kib']:>10.1f} {m['retained_kib']:>10.1f}")
+        finally:
+            delete_bench_user(user_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Core round views against ORM Round objects.')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed runs at 10 and 100 rows')
+    args = parser.parse_args()
+
+    run_benchmark(repeats=args.repeats)
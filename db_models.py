@@ -1,12 +1,58 @@
 """SQLAlchemy database models for Learn to Golf Tracker."""
 
 from datetime import datetime
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.util import find_tables
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
 
-db = SQLAlchemy()
+# Per-user tables that live on the user's shard; everything else is in the main database
+SHARDED_TABLES = frozenset({'users', 'user_profiles', 'rounds'})
+DEFAULT_SHARD = 'default'
+
+
+class ShardNotSelected(RuntimeError):
+    """A sharded table was queried before the session was routed to a shard."""
+
+
+class ShardedSession(Session):
+    """Session that sends per-user tables to the shard in session.info['shard'].
+    
+    With a single database (no SHARD_URLS) every table uses the default
+    engine and no routing is needed.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and len(current_app.config.get('SHARD_KEYS', ())) > 1:
+            # Core statements on tables (see round_views.py) carry no mapper
+            if mapper is not None:
+                tables = [inspect(mapper).local_table]
+            elif clause is not None:
+                tables = find_tables(clause, include_crud=True)
+            else:
+                tables = []
+            sharded = [t.name for t in tables if t.name in SHARDED_TABLES]
+            if sharded:
+                shard = self.info.get('shard')
+                if shard is None:
+                    raise ShardNotSelected(f"No shard selected for a query on {sharded[0]}")
+                return shard_engine(shard)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': ShardedSession})
+
+
+def shard_engine(shard):
+    """Engine for a shard key; the default shard is the main database."""
+    if shard == DEFAULT_SHARD:
+        return db.engine
+    return db.engines[shard]
 
 
 class User(UserMixin, db.Model):
@@ -42,7 +88,7 @@ class UserProfile(db.Model):
     __tablename__ = 'user_profiles'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     current_level = db.Column(db.Integer, default=1, nullable=False)
     total_rounds = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -74,8 +120,12 @@ class UserProfile(db.Model):
                                 .first()
         return best_round.total if best_round else 0
     
-    def add_round(self, holes):
-        """Add a new round and handle level progression."""
+    def add_round(self, holes, played_at=None):
+        """Add a new round and handle level progression.
+        
+        played_at defaults to now; rounds replayed from the score spool keep
+        the time they were submitted.
+        """
         total = sum(holes)
         leveled_up = total <= 36
         
@@ -85,11 +135,15 @@ class UserProfile(db.Model):
             level=self.current_level,
             holes=holes,
             total=total,
-            leveled_up=leveled_up
+            leveled_up=leveled_up,
+            played_at=played_at or datetime.utcnow()
         )
         
         db.session.add(round_obj)
         
+        # Invalidate cached rollups for any group this player belongs to
+        Group.bump_versions_for_user(self.user_id)
+        
         # Update user profile
         self.total_rounds += 1
         
@@ -110,12 +164,15 @@ class Round(db.Model):
     __tablename__ = 'rounds'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     level = db.Column(db.Integer, nullable=False)
     holes = db.Column(db.JSON, nullable=False)  # Array of 9 hole scores
     total = db.Column(db.Integer, nullable=False)
     leveled_up = db.Column(db.Boolean, default=False)
     played_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Set by the database when the row is inserted (migration 8); replayed rounds
+    # keep their old played_at, so the export's lag window goes by this instead
+    inserted_at = db.Column(db.DateTime, server_default=db.FetchedValue())
     
     def get_holes_list(self):
         """Get holes as a Python list (in case stored as JSON string)."""
@@ -127,20 +184,129 @@ class Round(db.Model):
         return f'<Round user_id={self.user_id} total={self.total} level={self.level}>'
 
 
-def init_db(app):
-    """Initialize the database with the Flask app."""
-    db.init_app(app)
+# Composite indexes for the per-user round queries above; user_id lookups use their prefix
+db.Index('idx_rounds_user_played', Round.user_id, Round.played_at.desc())
+db.Index('idx_rounds_user_level', Round.user_id, Round.level)
+
+
+class UserDirectory(db.Model):
+    """Global directory of every account and the shard holding its data.
+    
+    Lives in the main database. It allocates user ids, so ids stay unique
+    across shards, and resolves emails for /login and /register.
+    """
+    
+    __tablename__ = 'user_directory'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255), unique=True, nullable=False)
+    shard = db.Column(db.String(64), default=DEFAULT_SHARD, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserDirectory {self.email} user_id={self.user_id} shard={self.shard}>'
+
+
+class ProvisionJob(db.Model):
+    """A bulk provisioning run started from /admin/provision.
+    
+    Lives in the main database. The accounts are created by a separate
+    `init_db.py provision-job` process, which records progress here so any
+    web worker can report it.
+    """
+    
+    __tablename__ = 'provision_jobs'
     
-    with app.app_context():
-        db.create_all()
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued, running, done, failed
+    rows = db.Column(db.Integer, nullable=False)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    report = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<ProvisionJob {self.id} status={self.status} rows={self.rows}>'
+
+
+class Group(db.Model):
+    """A coaching group, e.g. a weekly group lesson."""
+    
+    __tablename__ = 'groups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    # Bumped when membership changes; with the members' own versions it keys cached rollups
+    data_version = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    members = db.relationship('GroupMember', backref='group', cascade='all, delete-orphan')
+    
+    @staticmethod
+    def bump_versions_for_user(user_id):
+        """Mark every group the user belongs to as changed.
         
-        # Create indexes for performance
-        try:
-            # Index on rounds for user queries
-            db.engine.execute(
-                'CREATE INDEX IF NOT EXISTS idx_rounds_user_played '
-                'ON rounds(user_id, played_at DESC)'
+        Bumps the user's own membership rows rather than the shared groups
+        row, so students in a large group never wait on each other's lock.
+        """
+        db.session.execute(
+            db.update(GroupMember)
+            .where(GroupMember.user_id == user_id)
+            .values(data_version=GroupMember.data_version + 1)
+        )
+    
+    def current_version(self):
+        """Version of the group's data: membership changes plus every member's round count."""
+        member_count, member_versions = db.session.execute(
+            db.select(func.count(), func.coalesce(func.sum(GroupMember.data_version), 0))
+            .where(GroupMember.group_id == self.id)
+        ).one()
+        return (self.data_version, member_count, member_versions)
+    
+    def add_members(self, emails, role='student'):
+        """Add existing users to the group by email in one statement.
+        
+        Returns the number of new memberships; unknown emails and existing
+        members are skipped.
+        """
+        result = db.session.execute(
+            insert(GroupMember)
+            .from_select(
+                ['group_id', 'user_id', 'role'],
+                db.select(db.literal(self.id), UserDirectory.user_id, db.literal(role))
+                .where(UserDirectory.email.in_([email.lower() for email in emails]))
             )
-        except Exception:
-            # Index might already exist
-            pass
\ No newline at end of file
+            .on_conflict_do_nothing()
+            .returning(GroupMember.user_id)
+        )
+        added = len(result.all())
+        self.data_version += 1
+        db.session.commit()
+        return added
+    
+    def is_coach(self, user_id):
+        """Check whether the user coaches this group."""
+        return db.session.query(
+            GroupMember.query.filter_by(group_id=self.id, user_id=user_id, role='coach').exists()
+        ).scalar()
+    
+    def __repr__(self):
+        return f'<Group {self.name} version={self.data_version}>'
+
+
+class GroupMember(db.Model):
+    """Membership of a user in a group, either as coach or student."""
+    
+    __tablename__ = 'group_members'
+    
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_directory.user_id', ondelete='CASCADE'),
+                        primary_key=True, index=True)
+    role = db.Column(db.String(16), default='student', nullable=False)  # 'coach' or 'student'
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by the member's add_round, see Group.current_version
+    data_version = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<GroupMember group_id={self.group_id} user_id={self.user_id} role={self.role}>'
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Export rounds and user profiles to Parquet for analytics.
+
+Analysts query these files instead of the production database. Rows are
+streamed through a server-side cursor in fixed-size chunks, so memory stays
+bounded regardless of table size, and holes are expanded into nine int8
+columns so scans never decode JSON.
+
+Layout under the output directory:
+
+    rounds/played_month=YYYY-MM/part-<run>-<shard>.parquet
+    user_profiles/export_date=YYYY-MM-DD/part-<run>.parquet   (the day's latest snapshot)
+    _watermark.json
+
+Each run exports only rounds with an id above the watermark from the last
+run. Rounds inserted within the last --lag-minutes are left for the next run,
+so a transaction that commits late can never be skipped. This goes by the
+inserted_at the database sets, not played_at: a round replayed from the
+score spool (see resilience.py) is inserted long after it was played. Every shard (see
+sharding.py) is streamed separately and keeps its own watermark, since
+interleaved ids only increase within a shard. Moving users between shards
+carries rounds across watermarks, so run --full after a rebalance.
+
+A shard's files and its watermark are committed together: the files are
+written under temporary names, the new watermark is saved along with the
+renames (and, for --full, the removals) still to do, and only then are the
+files moved into place. A run that dies part way through is finished by the
+next one, which completes any recorded renames and deletes temporary files
+that never reached a watermark, so no round is exported twice.
+
+Requires pyarrow: pip install pyarrow
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from db_models import DEFAULT_SHARD, shard_engine
+from init_db import create_app
+from sharding import shard_keys
+
+WATERMARK_FILE = '_watermark.json'
+DEFAULT_CHUNK_SIZE = 50_000
+DEFAULT_LAG_MINUTES = 10
+
+ROUNDS_QUERY = text(
+    "SELECT id, user_id, level, total, leveled_up, played_at, "
+    "(holes->>0)::smallint, (holes->>1)::smallint, (holes->>2)::smallint, "
+    "(holes->>3)::smallint, (holes->>4)::smallint, (holes->>5)::smallint, "
+    "(holes->>6)::smallint, (holes->>7)::smallint, (holes->>8)::smallint "
+    "FROM rounds WHERE id > :after_id AND id <= :until_id ORDER BY id"
+)
+
+PROFILES_QUERY = text(
+    "SELECT user_id, current_level, total_rounds, created_at FROM user_profiles ORDER BY id"
+)
+
+
+def _rounds_schema(pa):
+    return pa.schema(
+        [
+            ('id', pa.int64()),
+            ('user_id', pa.int32()),
+            ('level', pa.int8()),
+            ('total', pa.int16()),
+            ('leveled_up', pa.bool_()),
+            ('played_at', pa.timestamp('us')),
+        ]
+        + [(f'hole_{n}', pa.int8()) for n in range(1, 10)]
+    )
+
+
+def _profiles_schema(pa):
+    return pa.schema([
+        ('user_id', pa.int32()),
+        ('current_level', pa.int8()),
+        ('total_rounds', pa.int32()),
+        ('created_at', pa.timestamp('us')),
+    ])
+
+
+def _empty_shard_watermark():
+    return {'rounds_last_id': 0}
+
+
+def load_watermark(out_dir):
+    """Return the watermark from the previous run, or an empty one."""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {'shards': {}}
+    with open(path) as f:
+        watermark = json.load(f)
+    if 'shards' not in watermark:
+        # Written before sharding, when the main database held every round
+        watermark = {'shards': {DEFAULT_SHARD: {'rounds_last_id': watermark.get('rounds_last_id', 0)}}}
+    return watermark
+
+
+def save_watermark(out_dir, watermark):
+    """Write the watermark atomically so a crash never leaves it half written."""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def apply_pending(out_dir, watermark):
+    """Carry out the renames and removals recorded in the watermark, then clear them.
+
+    Safe to repeat, so a run that died after saving the watermark is finished
+    by the next one.
+    """
+    pending = watermark.pop('pending', None)
+    if not pending:
+        return
+    for temporary, final in pending['renames']:
+        if os.path.exists(os.path.join(out_dir, temporary)):
+            os.replace(os.path.join(out_dir, temporary), os.path.join(out_dir, final))
+    for path in pending['removals']:
+        if os.path.exists(os.path.join(out_dir, path)):
+            os.remove(os.path.join(out_dir, path))
+    save_watermark(out_dir, watermark)
+
+
+def commit_files(out_dir, watermark, renames, removals=()):
+    """Save the watermark with the file changes it depends on, then make them.
+
+    Paths are stored relative to out_dir so the export directory can be moved.
+    """
+    watermark['pending'] = {
+        'renames': [[os.path.relpath(t, out_dir), os.path.relpath(f, out_dir)] for t, f in renames],
+        'removals': [os.path.relpath(path, out_dir) for path in removals],
+    }
+    save_watermark(out_dir, watermark)
+    apply_pending(out_dir, watermark)
+
+
+def recover(out_dir, watermark):
+    """Finish the last run's recorded file changes and drop files it never committed."""
+    apply_pending(out_dir, watermark)
+    for path in glob.glob(os.path.join(out_dir, '*', '*', '*.parquet.tmp')):
+        os.remove(path)
+
+
+def round_files(out_dir, shard):
+    """Round files exported from one shard, including those from before sharding."""
+    paths = []
+    for path in glob.glob(os.path.join(out_dir, 'rounds', '*', 'part-*.parquet')):
+        # part-<run>-<shard>.parquet, or part-<run>.parquet for the main database
+        name = os.path.basename(path)[len('part-'):-len('.parquet')]
+        _, _, file_shard = name.partition('-')
+        if (file_shard or DEFAULT_SHARD) == shard:
+            paths.append(path)
+    return paths
+
+
+class PartitionedWriter:
+    """Keeps one ParquetWriter per partition open for the length of a run.
+
+    Each chunk becomes a row group, so memory is bounded by the chunk size.
+    Files are written under a temporary name; the caller renames them once
+    they are committed.
+    """
+
+    def __init__(self, pq, root, schema, run_id):
+        self.pq = pq
+        self.root = root
+        self.schema = schema
+        self.run_id = run_id
+        self.writers = {}
+
+    def write(self, partition, table):
+        if partition not in self.writers:
+            directory = os.path.join(self.root, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{self.run_id}.parquet')
+            writer = self.pq.ParquetWriter(path + '.tmp', self.schema, compression='zstd')
+            self.writers[partition] = (writer, path)
+        self.writers[partition][0].write_table(table)
+
+    def close(self):
+        """Finish every file. Returns (temporary, final) path pairs."""
+        files = []
+        for writer, path in self.writers.values():
+            writer.close()
+            files.append((path + '.tmp', path))
+        self.writers = {}
+        return files
+
+    def abort(self):
+        for writer, path in self.writers.values():
+            writer.close()
+            os.remove(path + '.tmp')
+        self.writers = {}
+
+
+def _stream(engine, query, params, chunk_size):
+    """Yield lists of rows from a server-side cursor."""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size)\
+                     .execute(query, params)
+        for partition in result.partitions(chunk_size):
+            yield partition
+
+
+def _export_upper_bound(engine, after_id, lag_minutes):
+    """Highest round id that is safe to export this run.
+
+    Stops just below the first row inserted within the lag window: ids from
+    the sequence can commit out of order, so rows past it may still be in
+    flight. Rows from before migration 8 have no inserted_at and are old.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=lag_minutes)
+    with engine.connect() as conn:
+        first_recent = conn.execute(
+            text("SELECT min(id) FROM rounds WHERE id > :after_id AND inserted_at > :cutoff"),
+            {'after_id': after_id, 'cutoff': cutoff}
+        ).scalar()
+        if first_recent is not None:
+            return first_recent - 1
+        return conn.execute(text("SELECT coalesce(max(id), 0) FROM rounds")).scalar()
+
+
+def export_rounds(pa, pq, out_dir, shard, watermark, run_id, chunk_size, lag_minutes):
+    """Write one shard's rounds above its watermark to month partitions. Returns stats.
+
+    The files are left under temporary names for commit_files.
+    """
+    schema = _rounds_schema(pa)
+    engine = shard_engine(shard)
+    after_id = watermark['rounds_last_id']
+    until_id = _export_upper_bound(engine, after_id, lag_minutes)
+
+    writer = PartitionedWriter(pq, os.path.join(out_dir, 'rounds'), schema, f'{run_id}-{shard}')
+    rows_written = 0
+    last_id = after_id
+    try:
+        for rows in _stream(engine, ROUNDS_QUERY, {'after_id': after_id, 'until_id': until_id}, chunk_size):
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            )
+            months = pa.compute.strftime(table['played_at'], format='%Y-%m')
+            for month in pa.compute.unique(months).to_pylist():
+                month_rows = table.filter(pa.compute.equal(months, month))
+                writer.write(f'played_month={month}', month_rows)
+
+            rows_written += len(rows)
+            last_id = rows[-1][0]
+        files = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    watermark['rounds_last_id'] = last_id
+    # Written by earlier versions and never read
+    watermark.pop('rounds_last_played_at', None)
+    return {'shard': shard, 'rows': rows_written, 'files': files, 'after_id': after_id, 'until_id': until_id}
+
+
+def export_profiles(pa, pq, out_dir, run_id, chunk_size):
+    """Write a dated snapshot of every user profile on every shard. Returns stats.
+
+    The files are left under temporary names for commit_files; 'replaced'
+    lists the earlier snapshot files of the same day, which the new one supersedes.
+    """
+    schema = _profiles_schema(pa)
+    partition = f"export_date={datetime.utcnow():%Y-%m-%d}"
+    replaced = glob.glob(os.path.join(out_dir, 'user_profiles', partition, 'part-*.parquet'))
+    writer = PartitionedWriter(pq, os.path.join(out_dir, 'user_profiles'), schema, run_id)
+    rows_written = 0
+    try:
+        for shard in shard_keys():
+            for rows in _stream(shard_engine(shard), PROFILES_QUERY, {}, chunk_size):
+                columns = list(zip(*rows))
+                writer.write(partition, pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                rows_written += len(rows)
+        files = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return {'rows': rows_written, 'files': files, 'replaced': replaced}
+
+
+def run_export(out_dir, full=False, chunk_size=DEFAULT_CHUNK_SIZE, lag_minutes=DEFAULT_LAG_MINUTES):
+    """Export new rounds and a profile snapshot, then advance the watermark."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute  # noqa: F401
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("The export needs pyarrow: pip install pyarrow")
+
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = load_watermark(out_dir)
+    recover(out_dir, watermark)
+    # Down to the microsecond, so runs in the same second never share file names
+    run_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    app = create_app()
+
+    started = time.perf_counter()
+    with app.app_context():
+        rounds = []
+        for shard in shard_keys():
+            if full:
+                # A full export replaces the shard's earlier files, but only once it has succeeded
+                replaced_files = round_files(out_dir, shard)
+                shard_watermark = _empty_shard_watermark()
+            else:
+                replaced_files = []
+                shard_watermark = dict(watermark['shards'].get(shard, _empty_shard_watermark()))
+            shard_rounds = export_rounds(pa, pq, out_dir, shard, shard_watermark, run_id, chunk_size, lag_minutes)
+
+            watermark['shards'][shard] = shard_watermark
+            watermark['exported_at'] = datetime.utcnow().isoformat()
+            commit_files(out_dir, watermark, shard_rounds['files'], replaced_files)
+            shard_rounds['files'] = [path for _, path in shard_rounds['files']]
+            rounds.append(shard_rounds)
+        profiles = export_profiles(pa, pq, out_dir, run_id, chunk_size)
+        # One snapshot per day, so a rerun never leaves two copies of every profile
+        commit_files(out_dir, watermark, profiles['files'], profiles['replaced'])
+        profiles['files'] = [path for _, path in profiles['files']]
+    elapsed = time.perf_counter() - started
+
+    for shard_rounds in rounds:
+        print(f"[{shard_rounds['shard']}] Exported {shard_rounds['rows']} rounds "
+              f"(id {shard_rounds['after_id']} < id <= {shard_rounds['until_id']}) "
+              f"into {len(shard_rounds['files'])} file(s); next run starts after round id "
+              f"{watermark['shards'][shard_rounds['shard']]['rounds_last_id']}")
+    print(f"Exported {profiles['rows']} user profiles")
+    print(f"Finished in {elapsed:.2f}s")
+    return {'rounds': rounds, 'profiles': profiles, 'elapsed_seconds': elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export rounds and profiles to Parquet.')
+    parser.add_argument('out_dir', help='Directory to write Parquet files and the watermark to')
+    parser.add_argument('--full', action='store_true', help='Ignore the watermark and export every round')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Rows fetched per server-side cursor batch (default {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--lag-minutes', type=int, default=DEFAULT_LAG_MINUTES,
+                        help=f'Leave rounds newer than this for the next run (default {DEFAULT_LAG_MINUTES})')
+    args = parser.parse_args()
+
+    run_export(args.out_dir, full=args.full, chunk_size=args.chunk_size, lag_minutes=args.lag_minutes)
@@ -0,0 +1,39 @@
+"""Gunicorn configuration for Learn to Golf Tracker.
+
+The app is imported once in the master (preload_app) so workers fork with
+modules and compiled templates already in memory. Database connections are
+only opened after fork, in each worker.
+"""
+
+import os
+
+bind = '0.0.0.0:8080'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+timeout = 120
+preload_app = True
+
+# This file runs in the master before the app is preloaded. Workers inherit the
+# master's pid so the app can time its first response from the master's start,
+# including the preload.
+os.environ['APP_MASTER_PID'] = str(os.getpid())
+
+
+def when_ready(server):
+    from app import app, warm_templates
+
+    if app.config['WARMUP_ENABLED']:
+        warm_templates(app)
+    server.log.info(f"Startup timings: {app.config['STARTUP_TIMINGS']}")
+
+
+def post_fork(server, worker):
+    from app import app, db, warm_database
+
+    # Never reuse a connection the master may have opened before forking, on any shard
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    if app.config['WARMUP_ENABLED']:
+        warm_database(app)
+        server.log.info(f"Worker {worker.pid} warmed up: {app.config['STARTUP_TIMINGS']}")
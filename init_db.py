@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 """Database initialization script for Learn to Golf Tracker."""
 
+import csv
+import json
 import os
+import sys
 from flask import Flask
-from db_models import db, User, UserProfile, Round
+from db_models import db, User, UserProfile, Round, Group, GroupMember, DEFAULT_SHARD, shard_engine
+from provisioning import read_students_csv, provision_students, run_provision_job
+from migrations import run_migrations, migration_status, audit_indexes, ROLE_MAIN, ROLE_SHARD
+from resilience import get_spool, replay_spool
+from sharding import (configure_shards, shard_keys, find_user_by_email, register_user,
+                      move_user, rebalance, shard_user_counts, interleave_id_sequences, sync_directory)
 
 def create_app():
     """Create Flask app with database configuration."""
@@ -16,49 +24,38 @@ def create_app():
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SPOOL_PATH'] = os.environ.get('SPOOL_PATH', os.path.join('spool', 'scores.sqlite3'))
+    configure_shards(app)
     
     # Initialize database
     db.init_app(app)
     
     return app
 
+def shard_databases():
+    """Yield (shard, engine, role) for the main database and every extra shard."""
+    for shard in shard_keys():
+        yield shard, shard_engine(shard), ROLE_MAIN if shard == DEFAULT_SHARD else ROLE_SHARD
+
 def init_database():
-    """Initialize database tables and indexes."""
+    """Initialize database tables and indexes by applying pending migrations."""
     app = create_app()
     
     with app.app_context():
         try:
-            # Create all tables
-            print("Creating database tables...")
-            db.create_all()
-            
-            # Create indexes for performance
-            print("Creating database indexes...")
-            
-            # Index for rounds lookup by user and date
-            db.session.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_rounds_user_played "
-                "ON rounds(user_id, played_at DESC)"
-            ))
-            
-            # Index for user email lookup
-            db.session.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_users_email "
-                "ON users(email)"
-            ))
-            
-            # Index for rounds by user and level
-            db.session.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_rounds_user_level "
-                "ON rounds(user_id, level)"
-            ))
-            
-            db.session.commit()
+            for shard, engine, role in shard_databases():
+                print(f"[{shard}]")
+                applied = run_migrations(engine, role)
+                
+                if applied:
+                    print(f"Applied {len(applied)} migration(s)")
+                else:
+                    print("Database schema is up to date")
             
             print("Database initialized successfully!")
             
             # Print table info
-            print("\nTables created:")
+            print("\nTables:")
             for table in db.metadata.tables.keys():
                 print(f"  - {table}")
                 
@@ -66,6 +63,42 @@ def init_database():
             print(f"Error initializing database: {e}")
             raise
 
+def show_migration_status():
+    """Print which migrations have been applied."""
+    app = create_app()
+    
+    with app.app_context():
+        for shard, engine, role in shard_databases():
+            print(f"[{shard}]")
+            for version, name, applied_at in migration_status(engine):
+                state = f"applied {applied_at:%Y-%m-%d %H:%M}" if applied_at else "pending"
+                print(f"  {version:>4}  {name:<40} {state}")
+
+def show_index_audit():
+    """Print unused, duplicate and missing indexes."""
+    app = create_app()
+    
+    reports = {}
+    with app.app_context():
+        for shard, engine, role in shard_databases():
+            reports[shard] = audit_indexes(engine, role)
+    
+    for shard, report in reports.items():
+        print(f"[{shard}]")
+        print("Unused indexes (no scans since stats reset):")
+        for ix in report['unused'] or [None]:
+            print(f"  - {ix['table']}.{ix['index']} ({ix['size_bytes'] // 1024} kB)" if ix else "  none")
+        
+        print("Duplicate indexes:")
+        for ix in report['duplicate'] or [None]:
+            print(f"  - {ix['table']}.{ix['index']} is covered by {ix['covered_by']}" if ix else "  none")
+        
+        print("Missing indexes:")
+        for ix in report['missing'] or [None]:
+            print(f"  - {ix['table']}({', '.join(ix['columns'])}) for {ix['reason']}" if ix else "  none")
+    
+    return reports
+
 def reset_database():
     """Drop all tables and recreate them (for development)."""
     app = create_app()
@@ -74,6 +107,12 @@ def reset_database():
         try:
             print("Dropping all tables...")
             db.drop_all()
+            for shard, engine, role in shard_databases():
+                with engine.begin() as conn:
+                    if role == ROLE_SHARD:
+                        for model in (Round, UserProfile, User):
+                            model.__table__.drop(bind=conn, checkfirst=True)
+                    conn.execute(db.text("DROP TABLE IF EXISTS schema_migrations"))
             
             print("Recreating tables...")
             init_database()
@@ -89,22 +128,13 @@ def create_test_user():
     with app.app_context():
         try:
             # Check if test user already exists
-            test_user = User.query.filter_by(email='test@learntogolf.com').first()
+            test_user = find_user_by_email('test@learntogolf.com')
             if test_user:
                 print("Test user already exists!")
                 return test_user
             
-            # Create test user
-            user = User(email='test@learntogolf.com')
-            user.set_password('password123')
-            
-            db.session.add(user)
-            db.session.commit()
-            
-            # Create user profile
-            profile = UserProfile(user_id=user.id)
-            db.session.add(profile)
-            db.session.commit()
+            # Create test user and profile on its shard
+            user = register_user('test@learntogolf.com', 'password123')
             
             print(f"Test user created: {user.email}")
             print("Password: password123")
@@ -116,6 +146,174 @@ def create_test_user():
             db.session.rollback()
             raise
 
+def provision_from_csv(csv_path, batch_size=500):
+    """Create accounts for every student in a CSV file."""
+    app = create_app()
+    
+    # Read as bytes so lines that are not UTF-8 are reported rather than fatal
+    with open(csv_path, 'rb') as f:
+        students, errors = read_students_csv(f.read())
+    
+    for error in errors:
+        print(f"Skipping {error}")
+    
+    if not students:
+        print("No students to provision.")
+        return None
+    
+    with app.app_context():
+        try:
+            print(f"Provisioning {len(students)} students...")
+            report = provision_students(students, batch_size=batch_size)
+        except Exception as e:
+            print(f"Error provisioning students: {e}")
+            raise
+    
+    print(f"Created {report['created']} accounts, skipped {report['skipped']} existing emails")
+    print(f"Hashing: {report['hash_seconds']}s, inserts: {report['insert_seconds']}s")
+    print(f"Throughput: {report['rows_per_second']} rows/s over {report['elapsed_seconds']}s")
+    
+    if report['invites']:
+        invites_path = os.path.splitext(csv_path)[0] + '-invites.csv'
+        with open(invites_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['email', 'invite_token'])
+            writer.writerows(sorted(report['invites'].items()))
+        print(f"Invite tokens written to {invites_path}")
+    
+    return report
+
+def run_queued_provision_job(job_id):
+    """Run a job queued by /admin/provision; the students arrive as JSON on stdin."""
+    payload = json.load(sys.stdin)
+    app = create_app()
+    
+    with app.app_context():
+        print(f"Provisioning job {job_id}: {len(payload['students'])} students...")
+        report = run_provision_job(job_id, payload)
+    
+    print(f"Job {job_id}: created {report['created']} accounts, skipped {report['skipped']} existing emails "
+          f"in {report['elapsed_seconds']}s")
+    return report
+
+def create_group(name, coach_email):
+    """Create a coaching group with the given coach."""
+    app = create_app()
+    
+    with app.app_context():
+        coach = find_user_by_email(coach_email.lower())
+        if not coach:
+            print(f"No user with email {coach_email}")
+            return None
+        
+        try:
+            group = Group(name=name)
+            group.members.append(GroupMember(user_id=coach.id, role='coach'))
+            db.session.add(group)
+            db.session.commit()
+        except Exception as e:
+            print(f"Error creating group: {e}")
+            db.session.rollback()
+            raise
+        
+        print(f"Group created: {group.name} (id {group.id}), coached by {coach.email}")
+        return group.id
+
+def add_group_students(group_id, csv_path):
+    """Add every student listed in a CSV to a group."""
+    app = create_app()
+    
+    # Read as bytes so lines that are not UTF-8 are reported rather than fatal
+    with open(csv_path, 'rb') as f:
+        students, errors = read_students_csv(f.read())
+    
+    for error in errors:
+        print(f"Skipping {error}")
+    
+    with app.app_context():
+        group = db.session.get(Group, group_id)
+        if not group:
+            print(f"No group with id {group_id}")
+            return 0
+        
+        try:
+            added = group.add_members([email for email, _ in students])
+        except Exception as e:
+            print(f"Error adding students: {e}")
+            db.session.rollback()
+            raise
+        
+        print(f"Added {added} students to {group.name} ({len(students) - added} already members or unknown)")
+        return added
+
+def show_shards():
+    """Print how many users each shard holds."""
+    app = create_app()
+    
+    with app.app_context():
+        counts = shard_user_counts()
+        new_user_shards = app.config['SHARD_NEW_USERS']
+    
+    for shard, count in counts.items():
+        note = " (takes new users)" if shard in new_user_shards else ""
+        print(f"  {shard:<12} {count:>8} users{note}")
+    return counts
+
+def init_shards():
+    """Migrate every shard and interleave id sequences so ids never collide."""
+    init_database()
+    app = create_app()
+    
+    with app.app_context():
+        print("Interleaving id sequences...")
+        interleave_id_sequences()
+
+def sync_user_directory():
+    """Add directory entries for accounts created by the previous release during a deploy."""
+    app = create_app()
+    
+    with app.app_context():
+        added = sync_directory()
+    
+    print(f"Added {added} user(s) to the directory")
+    return added
+
+def move_user_to_shard(user_id, target_shard):
+    """Move one user's rows to another shard."""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            moved = move_user(user_id, target_shard)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+    
+    print(f"Moved user {user_id} to {target_shard}" if moved else f"User {user_id} is already on {target_shard}")
+    return moved
+
+def rebalance_shards(max_moves=100):
+    """Even out user counts across shards."""
+    app = create_app()
+    
+    with app.app_context():
+        moves = rebalance(max_moves)
+    
+    for user_id, source, target in moves:
+        print(f"  user {user_id}: {source} -> {target}")
+    print(f"Moved {len(moves)} user(s)")
+    return moves
+
+def replay_score_spool():
+    """Record rounds submitted while the database was unavailable."""
+    app = create_app()
+    spool = get_spool(app)
+    
+    print(f"Spooled rounds: {spool.pending_count()} pending, {spool.failed_count()} failed")
+    replayed, failed = replay_spool(app)
+    print(f"Recorded {replayed} round(s), {failed} failed, {spool.pending_count()} still pending")
+    return replayed
+
 if __name__ == '__main__':
     import sys
     
@@ -126,12 +324,49 @@ if __name__ == '__main__':
             reset_database()
         elif command == 'test-user':
             create_test_user()
-        elif command == 'init':
-            init_database()
+        elif command in ('init', 'migrate'):
+            subcommand = sys.argv[2] if len(sys.argv) > 2 else None
+            if subcommand == 'status':
+                show_migration_status()
+            elif subcommand == 'audit':
+                show_index_audit()
+            else:
+                init_database()
+        elif command == 'provision' and len(sys.argv) > 2:
+            provision_from_csv(sys.argv[2])
+        elif command == 'provision-job' and len(sys.argv) > 2:
+            run_queued_provision_job(int(sys.argv[2]))
+        elif command == 'group-create' and len(sys.argv) > 3:
+            create_group(sys.argv[2], sys.argv[3])
+        elif command == 'group-add' and len(sys.argv) > 3:
+            add_group_students(int(sys.argv[2]), sys.argv[3])
+        elif command == 'spool':
+            replay_score_spool()
+        elif command == 'shards':
+            subcommand = sys.argv[2] if len(sys.argv) > 2 else 'status'
+            if subcommand == 'init':
+                init_shards()
+            elif subcommand == 'sync':
+                sync_user_directory()
+            elif subcommand == 'move' and len(sys.argv) > 4:
+                move_user_to_shard(int(sys.argv[3]), sys.argv[4])
+            elif subcommand == 'rebalance':
+                rebalance_shards(int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+            else:
+                show_shards()
         else:
-            print("Usage: python init_db.py [init|reset|test-user]")
+            print("Usage: python init_db.py [init|migrate [status|audit]|reset|test-user|provision <students.csv>|")
+            print("                          group-create <name> <coach_email>|group-add <group_id> <students.csv>|")
+            print("                          shards [status|init|sync|move <user_id> <shard>|rebalance [max_moves]]|spool]")
             print("  init      - Initialize database tables")
+            print("  migrate   - Apply pending migrations; 'status' lists them, 'audit' checks indexes")
             print("  reset     - Drop and recreate all tables")
             print("  test-user - Create a test user account")
+            print("  provision - Bulk create accounts from a CSV (email[,password])")
+            print("  provision-job - Run a job queued by /admin/provision (started by the web app)")
+            print("  group-create - Create a coaching group")
+            print("  group-add    - Add students from a CSV to a group")
+            print("  shards    - Show users per shard, set up shards, sync the user directory, or move users")
+            print("  spool     - Record rounds saved locally while the database was unavailable")
     else:
         init_database()
\ No newline at end of file
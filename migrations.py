@@ -0,0 +1,400 @@
+"""Versioned schema migrations for Learn to Golf Tracker.
+
+Migrations are functions registered in order with @migration. They run
+against the main database and every shard (see sharding.py); each receives
+the database's role so main-only steps can be skipped on shards. Each one runs on
+an autocommit connection so it can use CREATE INDEX CONCURRENTLY and commit
+backfill batches as it goes, instead of holding locks in one long transaction.
+A migration is recorded in schema_migrations only after it completes, so
+every step must be safe to re-run after a failure.
+"""
+
+import time
+from sqlalchemy import text
+from db_models import db, SHARDED_TABLES
+
+# The main database holds everything; extra shards only hold per-user tables
+ROLE_MAIN = 'main'
+ROLE_SHARD = 'shard'
+
+# Key for pg_advisory_lock so two deploys never migrate at once
+MIGRATION_LOCK_ID = 7_312_026
+# Give up on DDL instead of queueing behind long transactions and blocking traffic
+LOCK_TIMEOUT = '5s'
+
+MIGRATIONS = []
+
+# Index needs derived from the query patterns in db_models.py, used by the audit
+EXPECTED_INDEXES = [
+    ('users', ('email',), 'User lookup by email on /login and /register'),
+    ('user_profiles', ('user_id',), 'User.profile relationship load on every request'),
+    ('rounds', ('user_id', 'played_at'), 'UserProfile.get_recent_rounds'),
+    ('rounds', ('user_id', 'level'), 'UserProfile.get_rounds_at_current_level'),
+    ('group_members', ('group_id',), 'Group dashboard rollups'),
+    ('group_members', ('user_id',), 'Group.bump_versions_for_user in add_round'),
+    ('user_directory', ('email',), 'Directory lookup by email on /login and /register'),
+]
+
+
+def migration(version, name):
+    """Register a migration function under a version number.
+    
+    The function is called as func(conn, role) with role ROLE_MAIN or ROLE_SHARD.
+    """
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def create_index_concurrently(conn, name, table, columns, unique=False):
+    """Build an index without blocking writes. Returns True if it was built.
+
+    A failed CONCURRENTLY build leaves an INVALID index behind, so one with
+    the same name is dropped and rebuilt rather than skipped.
+    """
+    existing = conn.execute(text(
+        "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+        "WHERE c.relname = :name AND c.relnamespace = current_schema()::regnamespace"
+    ), {'name': name}).first()
+    if existing is not None:
+        if existing.indisvalid:
+            return False
+        print(f"  Rebuilding invalid index {name}")
+        conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+    print(f"  Building index {name} on {table}({columns})")
+    unique_sql = 'UNIQUE ' if unique else ''
+    conn.exec_driver_sql(f'CREATE {unique_sql}INDEX CONCURRENTLY {name} ON {table} ({columns})')
+    return True
+
+
+def drop_index_concurrently(conn, name):
+    """Drop an index without blocking reads or writes on its table."""
+    print(f"  Dropping index {name}")
+    conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+def backfill_in_batches(conn, table, set_sql, where_sql, batch_size=1000, pause=0.05):
+    """UPDATE a table in primary key ranges, committing each batch.
+
+    Walking id ranges keeps every batch an index range scan, and committing
+    between batches means row locks are held only briefly.
+    """
+    max_id = conn.execute(text(f'SELECT max(id) FROM {table}')).scalar() or 0
+    updated = 0
+    for low in range(0, max_id, batch_size):
+        result = conn.execute(
+            text(f'UPDATE {table} SET {set_sql} WHERE id > :low AND id <= :high AND ({where_sql})'),
+            {'low': low, 'high': low + batch_size}
+        )
+        updated += result.rowcount
+        if pause:
+            time.sleep(pause)
+    return updated
+
+
+def tables_for_role(role):
+    """Names of the tables a database with this role holds."""
+    if role == ROLE_MAIN:
+        return set(db.metadata.tables)
+    return set(SHARDED_TABLES)
+
+
+# The schema db.create_all produced before migrations existed, frozen so that
+# migration 1 means the same thing on every database whatever the models say
+# now. Later changes belong in new migrations. Each table's indexes are only
+# created along with the table, as create_all did.
+BASELINE_SCHEMA = [
+    ('users', [
+        'CREATE TABLE users ('
+        'id SERIAL NOT NULL, '
+        'email VARCHAR(255) NOT NULL, '
+        'password_hash VARCHAR(255) NOT NULL, '
+        'created_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (id))',
+        'CREATE UNIQUE INDEX ix_users_email ON users (email)',
+    ]),
+    ('user_profiles', [
+        'CREATE TABLE user_profiles ('
+        'id SERIAL NOT NULL, '
+        'user_id INTEGER NOT NULL, '
+        'current_level INTEGER NOT NULL, '
+        'total_rounds INTEGER NOT NULL, '
+        'created_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (id), '
+        'FOREIGN KEY (user_id) REFERENCES users (id))',
+    ]),
+    ('rounds', [
+        'CREATE TABLE rounds ('
+        'id SERIAL NOT NULL, '
+        'user_id INTEGER NOT NULL, '
+        'level INTEGER NOT NULL, '
+        'holes JSON NOT NULL, '
+        'total INTEGER NOT NULL, '
+        'leveled_up BOOLEAN, '
+        'played_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (id), '
+        'FOREIGN KEY (user_id) REFERENCES users (id))',
+        'CREATE INDEX ix_rounds_user_id ON rounds (user_id)',
+        'CREATE INDEX ix_rounds_played_at ON rounds (played_at)',
+    ]),
+    ('groups', [
+        'CREATE TABLE groups ('
+        'id SERIAL NOT NULL, '
+        'name VARCHAR(255) NOT NULL, '
+        'data_version INTEGER NOT NULL, '
+        'created_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (id))',
+    ]),
+    ('group_members', [
+        'CREATE TABLE group_members ('
+        'group_id INTEGER NOT NULL, '
+        'user_id INTEGER NOT NULL, '
+        'role VARCHAR(16) NOT NULL, '
+        'joined_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (group_id, user_id), '
+        'FOREIGN KEY (group_id) REFERENCES groups (id) ON DELETE CASCADE, '
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE)',
+        'CREATE INDEX ix_group_members_user_id ON group_members (user_id)',
+    ]),
+]
+
+
+def table_exists(conn, table):
+    return conn.execute(text('SELECT to_regclass(:table) IS NOT NULL'), {'table': table}).scalar()
+
+
+@migration(1, 'baseline schema')
+def _baseline_schema(conn, role):
+    # Only creates missing tables, so existing databases adopt this as-is
+    for table, statements in BASELINE_SCHEMA:
+        if role != ROLE_MAIN and table not in SHARDED_TABLES:
+            continue
+        if table_exists(conn, table):
+            continue
+        print(f"  Creating table {table}")
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+
+@migration(2, 'per-user query indexes')
+def _per_user_indexes(conn, role):
+    create_index_concurrently(conn, 'idx_rounds_user_played', 'rounds', 'user_id, played_at DESC')
+    create_index_concurrently(conn, 'idx_rounds_user_level', 'rounds', 'user_id, level')
+    create_index_concurrently(conn, 'ix_user_profiles_user_id', 'user_profiles', 'user_id')
+
+
+@migration(3, 'drop redundant indexes')
+def _drop_redundant_indexes(conn, role):
+    # Duplicates the unique index ix_users_email
+    drop_index_concurrently(conn, 'idx_users_email')
+    # Leading column of idx_rounds_user_played
+    drop_index_concurrently(conn, 'ix_rounds_user_id')
+
+
+@migration(4, 'store holes as JSON arrays')
+def _normalize_holes(conn, role):
+    # Some early rounds stored holes as a JSON-encoded string, see Round.get_holes_list
+    updated = backfill_in_batches(
+        conn, 'rounds',
+        "holes = (holes #>> '{}')::json",
+        "json_typeof(holes) = 'string'"
+    )
+    print(f"  Normalized holes for {updated} rounds")
+
+
+@migration(5, 'user directory')
+def _user_directory(conn, role):
+    if role != ROLE_MAIN:
+        return
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS user_directory ('
+        'user_id SERIAL NOT NULL, '
+        'email VARCHAR(255) NOT NULL, '
+        'shard VARCHAR(64) NOT NULL, '
+        'created_at TIMESTAMP WITHOUT TIME ZONE, '
+        'PRIMARY KEY (user_id), '
+        'UNIQUE (email))'
+    )
+    # Every existing account lives on the default shard, the main database
+    max_id = conn.execute(text('SELECT coalesce(max(id), 0) FROM users')).scalar()
+    copied = 0
+    for low in range(0, max_id, 1000):
+        result = conn.execute(text(
+            "INSERT INTO user_directory (user_id, email, shard, created_at) "
+            "SELECT id, email, 'default', created_at FROM users WHERE id > :low AND id <= :high "
+            "ON CONFLICT DO NOTHING"
+        ), {'low': low, 'high': low + 1000})
+        copied += result.rowcount
+    print(f"  Copied {copied} users into the directory")
+    # The directory now allocates user ids
+    conn.exec_driver_sql(
+        "SELECT setval(pg_get_serial_sequence('user_directory', 'user_id'), greatest(max_id, 1), max_id > 0) "
+        "FROM (SELECT coalesce(max(user_id), 0) AS max_id FROM user_directory) AS ids"
+    )
+    # Members may live on any shard, so point the foreign key at the directory.
+    # NOT VALID then VALIDATE avoids holding a write lock during the table scan.
+    conn.exec_driver_sql('ALTER TABLE group_members DROP CONSTRAINT IF EXISTS group_members_user_id_fkey')
+    conn.exec_driver_sql(
+        'ALTER TABLE group_members ADD CONSTRAINT group_members_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES user_directory (user_id) ON DELETE CASCADE NOT VALID'
+    )
+    conn.exec_driver_sql('ALTER TABLE group_members VALIDATE CONSTRAINT group_members_user_id_fkey')
+
+
+@migration(6, 'provisioning jobs')
+def _provision_jobs(conn, role):
+    if role != ROLE_MAIN:
+        return
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS provision_jobs ('
+        'id SERIAL NOT NULL, '
+        'status VARCHAR(16) NOT NULL, '
+        'rows INTEGER NOT NULL, '
+        'created_by INTEGER, '
+        'created_at TIMESTAMP WITHOUT TIME ZONE, '
+        'finished_at TIMESTAMP WITHOUT TIME ZONE, '
+        'report JSON, '
+        'error TEXT, '
+        'PRIMARY KEY (id))'
+    )
+
+
+@migration(7, 'per-member group versions')
+def _member_versions(conn, role):
+    if role != ROLE_MAIN:
+        return
+    # A constant default makes this a catalog-only change, with no table rewrite
+    conn.exec_driver_sql(
+        'ALTER TABLE group_members ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0'
+    )
+
+
+@migration(8, 'round insert times')
+def _round_inserted_at(conn, role):
+    # Added without a default so existing rows keep NULL and nothing is rewritten;
+    # new rows then get the start of their inserting transaction
+    conn.exec_driver_sql('ALTER TABLE rounds ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMP WITHOUT TIME ZONE')
+    conn.exec_driver_sql("ALTER TABLE rounds ALTER COLUMN inserted_at SET DEFAULT (now() AT TIME ZONE 'utc')")
+
+
+def _ensure_migrations_table(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR(255) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+
+
+def migration_status(engine):
+    """Return [(version, name, applied_at or None)] for every migration."""
+    with engine.connect() as conn:
+        _ensure_migrations_table(conn)
+        applied = dict(conn.execute(text('SELECT version, applied_at FROM schema_migrations')).all())
+        conn.commit()
+    return [(version, name, applied.get(version)) for version, name, _ in MIGRATIONS]
+
+
+def run_migrations(engine, role=ROLE_MAIN):
+    """Apply pending migrations in order. Returns the versions applied."""
+    applied_now = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+        try:
+            conn.exec_driver_sql(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+            _ensure_migrations_table(conn)
+            applied = {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+            for version, name, func in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"Applying migration {version}: {name}")
+                started = time.perf_counter()
+                func(conn, role)
+                conn.execute(
+                    text('INSERT INTO schema_migrations (version, name) VALUES (:version, :name)'),
+                    {'version': version, 'name': name}
+                )
+                print(f"  Done in {time.perf_counter() - started:.2f}s")
+                applied_now.append(version)
+        finally:
+            conn.exec_driver_sql('RESET lock_timeout')
+            conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+    return applied_now
+
+
+def audit_indexes(engine, role=ROLE_MAIN):
+    """Report unused, duplicate and missing indexes.
+
+    Unused indexes come from pg_stat_user_indexes scan counts since the last
+    stats reset; missing indexes are checked against EXPECTED_INDEXES, limited
+    to the tables a database with this role holds.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT s.relname AS table_name, s.indexrelname AS index_name, s.idx_scan, "
+            "i.indisunique, i.indisprimary, i.indisvalid, "
+            "pg_relation_size(s.indexrelid) AS size_bytes, "
+            "pg_get_expr(i.indpred, i.indrelid) AS predicate, "
+            "0 = ANY(i.indkey::int2[]) AS has_expression, "
+            "ARRAY(SELECT a.attname FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord) "
+            "      JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum "
+            "      ORDER BY k.ord) AS columns "
+            "FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid "
+            "WHERE s.schemaname = current_schema() "
+            "ORDER BY s.relname, s.indexrelname"
+        )).mappings().all()
+
+    indexes = [dict(row, columns=tuple(row['columns'])) for row in rows]
+    return analyze_indexes(indexes, tables_for_role(role))
+
+
+def analyze_indexes(indexes, tables):
+    """Find unused, duplicate and missing indexes in rows from audit_indexes' query.
+
+    tables limits the EXPECTED_INDEXES checked to the tables a database holds.
+    """
+    unused = [
+        {'table': ix['table_name'], 'index': ix['index_name'], 'size_bytes': ix['size_bytes']}
+        for ix in indexes
+        if ix['idx_scan'] == 0 and not ix['indisunique'] and not ix['indisprimary']
+    ]
+
+    duplicate = []
+    for ix in indexes:
+        if ix['indisunique'] or ix['has_expression']:
+            continue
+        for other in indexes:
+            if other is ix or other['table_name'] != ix['table_name'] or other['has_expression']:
+                continue
+            if other['predicate'] != ix['predicate'] or not other['indisvalid']:
+                continue
+            same = other['columns'] == ix['columns']
+            # For identical non-unique pairs report only one of them
+            if same and not other['indisunique'] and other['index_name'] > ix['index_name']:
+                continue
+            if same or other['columns'][:len(ix['columns'])] == ix['columns']:
+                duplicate.append({
+                    'table': ix['table_name'],
+                    'index': ix['index_name'],
+                    'covered_by': other['index_name'],
+                    'size_bytes': ix['size_bytes'],
+                })
+                break
+
+    missing = []
+    for table, columns, reason in EXPECTED_INDEXES:
+        if table not in tables:
+            continue
+        covered = any(
+            ix['table_name'] == table and ix['indisvalid'] and ix['predicate'] is None
+            and ix['columns'][:len(columns)] == columns
+            for ix in indexes
+        )
+        if not covered:
+            missing.append({'table': table, 'columns': list(columns), 'reason': reason})
+
+    return {'unused': unused, 'duplicate': duplicate, 'missing': missing}
@@ -0,0 +1,320 @@
+"""On-demand request profiling for Learn to Golf Tracker.
+
+When PROFILING_ENABLED is set, requests carrying a valid signed
+X-Profile-Token header (or picked by PROFILING_SAMPLE_RATE) are run under a
+sampling profiler. Each profiled request writes a directory containing:
+
+- profile.html            interactive pyinstrument call tree
+- profile.speedscope.json open at https://www.speedscope.app
+- profile.folded          collapsed stacks for flamegraph.pl / speedscope
+- summary.json            timings split into SQL, templates and other work,
+                          plus EXPLAIN (ANALYZE, BUFFERS) for slow SELECTs
+
+Only the newest PROFILING_MAX_PROFILES directories, none older than
+PROFILING_MAX_AGE_HOURS, are kept, so sampling in production cannot fill
+the disk.
+
+When profiling is disabled no hooks are registered and pyinstrument is never
+imported, so requests pay nothing.
+
+Generate a header token with: SECRET_KEY=... python profiling.py token
+"""
+
+import json
+import os
+import random
+import shutil
+import time
+import uuid
+from datetime import datetime
+from flask import g, request, current_app, has_request_context, before_render_template, template_rendered
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = 'X-Profile-Token'
+TOKEN_SALT = 'learntogolf-profile'
+
+
+def init_profiling(app):
+    """Register profiling hooks on the app if PROFILING_ENABLED is set."""
+    if not app.config.get('PROFILING_ENABLED'):
+        return False
+
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        print("Profiling disabled: pyinstrument is not installed")
+        return False
+
+    app.config.setdefault('PROFILING_DIR', 'profiles')
+    app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILING_SQL_THRESHOLD_MS', 50.0)
+    app.config.setdefault('PROFILING_INTERVAL', 0.001)
+    app.config.setdefault('PROFILING_TOKEN_MAX_AGE', 24 * 3600)
+    app.config.setdefault('PROFILING_MAX_PROFILES', 200)
+    app.config.setdefault('PROFILING_MAX_AGE_HOURS', 72)
+    os.makedirs(app.config['PROFILING_DIR'], exist_ok=True)
+
+    app.before_request(_start_profile)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_profile)
+
+    # Engine events are global, so listen once however many apps are created
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    print(f"Profiling enabled, writing to {app.config['PROFILING_DIR']}")
+    return True
+
+
+def make_profile_token(secret_key):
+    """Create a signed token for the X-Profile-Token header."""
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps('profile')
+
+
+def _profile_trigger(app):
+    """Return why this request should be profiled, or None."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=TOKEN_SALT)
+        try:
+            serializer.loads(token, max_age=app.config['PROFILING_TOKEN_MAX_AGE'])
+            return 'header'
+        except BadSignature:
+            pass
+
+    sample_rate = app.config['PROFILING_SAMPLE_RATE']
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+def _current_profile():
+    """The profile state for the active request, if it is being profiled."""
+    if not has_request_context():
+        return None
+    return g.get('_profile')
+
+
+def _start_profile():
+    from pyinstrument import Profiler
+
+    trigger = _profile_trigger(current_app)
+    if trigger is None:
+        return
+
+    profiler = Profiler(interval=current_app.config['PROFILING_INTERVAL'], async_mode='disabled')
+    g._profile = {
+        'trigger': trigger,
+        'profiler': profiler,
+        'started_at': datetime.utcnow(),
+        'start': time.perf_counter(),
+        'status': 500,
+        'recording_sql': True,
+        'queries': [],
+        'query_starts': [],
+        'template_starts': [],
+        'templates': [],
+    }
+    profiler.start()
+
+
+def _record_status(response):
+    profile = _current_profile()
+    if profile:
+        profile['status'] = response.status_code
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    if profile and profile['recording_sql']:
+        profile['query_starts'].append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    if profile and profile['recording_sql'] and profile['query_starts']:
+        duration_ms = (time.perf_counter() - profile['query_starts'].pop()) * 1000
+        profile['queries'].append({
+            'statement': statement,
+            'parameters': None if executemany else parameters,
+            'duration_ms': duration_ms,
+            # The shard the query ran on, so EXPLAIN runs against the same data
+            'engine': conn.engine,
+            # Lazy loads and helper calls made from inside templates
+            'in_template': bool(profile['template_starts']),
+        })
+
+
+def _before_render(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile:
+        profile['template_starts'].append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile and profile['template_starts']:
+        duration_ms = (time.perf_counter() - profile['template_starts'].pop()) * 1000
+        profile['templates'].append({'name': template.name, 'duration_ms': duration_ms})
+
+
+def _finish_profile(exc):
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return
+
+    profiler = profile['profiler']
+    profiler.stop()
+    duration_ms = (time.perf_counter() - profile['start']) * 1000
+    profile['recording_sql'] = False
+
+    endpoint = request.endpoint or 'unknown'
+    out_dir = os.path.join(
+        current_app.config['PROFILING_DIR'],
+        f"{profile['started_at'].strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+    )
+
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, 'profile.html'), 'w') as f:
+            f.write(profiler.output_html())
+        with open(os.path.join(out_dir, 'profile.speedscope.json'), 'w') as f:
+            f.write(profiler.output(SpeedscopeRenderer()))
+        with open(os.path.join(out_dir, 'profile.folded'), 'w') as f:
+            root = profiler.last_session.root_frame()
+            if root is not None:
+                for stack, seconds in _folded_stacks(root).items():
+                    f.write(f"{stack} {max(1, round(seconds * 1_000_000))}\n")
+
+        summary = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': profile['status'],
+            'trigger': profile['trigger'],
+            'error': repr(exc) if exc else None,
+            'started_at': profile['started_at'].isoformat() + 'Z',
+            'duration_ms': round(duration_ms, 2),
+            **summarize_timings(profile, duration_ms, current_app.config['PROFILING_SQL_THRESHOLD_MS']),
+        }
+        with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+    except Exception as e:
+        # Profiling must never break the request it is observing
+        print(f"Profiling warning: could not write {out_dir}: {e}")
+
+    try:
+        prune_profiles(current_app.config['PROFILING_DIR'], current_app.config['PROFILING_MAX_PROFILES'],
+                       current_app.config['PROFILING_MAX_AGE_HOURS'])
+    except OSError as e:
+        print(f"Profiling warning: could not remove old profiles: {e}")
+
+
+def summarize_timings(profile, duration_ms, threshold_ms):
+    """Split a request's time into SQL, templates and other work, with plans for slow SELECTs."""
+    sql_ms = sum(q['duration_ms'] for q in profile['queries'])
+    # Count queries issued while rendering as SQL time, not template time
+    template_ms = sum(t['duration_ms'] for t in profile['templates'])
+    template_ms -= sum(q['duration_ms'] for q in profile['queries'] if q['in_template'])
+    return {
+        'sql': {
+            'count': len(profile['queries']),
+            'total_ms': round(sql_ms, 2),
+            'slow': [
+                {
+                    'statement': q['statement'],
+                    'duration_ms': round(q['duration_ms'], 2),
+                    'plan': _explain(q),
+                }
+                for q in profile['queries'] if q['duration_ms'] >= threshold_ms
+            ],
+        },
+        'templates': {
+            'count': len(profile['templates']),
+            'total_ms': round(template_ms, 2),
+            'renders': [
+                {'name': t['name'], 'duration_ms': round(t['duration_ms'], 2)}
+                for t in profile['templates']
+            ],
+        },
+        # Python work outside SQL and Jinja, e.g. HTML built inline in views
+        'other_ms': round(max(0.0, duration_ms - sql_ms - template_ms), 2),
+    }
+
+
+def prune_profiles(profiles_dir, max_profiles, max_age_hours):
+    """Delete profile directories beyond the newest max_profiles or older than max_age_hours.
+
+    Returns the number removed.
+    """
+    entries = []
+    with os.scandir(profiles_dir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                entries.append((entry.stat().st_mtime, entry.path))
+    entries.sort(reverse=True)
+
+    cutoff = time.time() - max_age_hours * 3600
+    stale = [path for i, (mtime, path) in enumerate(entries) if i >= max_profiles or mtime < cutoff]
+    for path in stale:
+        shutil.rmtree(path, ignore_errors=True)
+    return len(stale)
+
+
+def _folded_stacks(root):
+    """Collapse a pyinstrument frame tree into {'a;b;c': self_seconds}."""
+    stacks = {}
+    pending = [(root, [])]
+    while pending:
+        frame, parents = pending.pop()
+        if frame.is_synthetic:
+            # '[self]' and similar leaves: attribute their time to the parent
+            key = ';'.join(parents)
+            stacks[key] = stacks.get(key, 0.0) + frame.time
+            continue
+
+        path = parents + [f"{frame.function} ({frame.file_path_short}:{frame.line_no})"]
+        self_time = frame.time - sum(child.time for child in frame.children)
+        if self_time > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0.0) + self_time
+        pending.extend((child, path) for child in frame.children)
+    return stacks
+
+
+def _explain(query):
+    """EXPLAIN (ANALYZE, BUFFERS) a slow SELECT; other statements are not re-run."""
+    statement = query['statement'].lstrip()
+    engine = query['engine']
+    if not statement[:6].upper() == 'SELECT' or engine.dialect.name != 'postgresql':
+        return None
+
+    try:
+        with engine.connect() as conn:
+            result = conn.exec_driver_sql(
+                'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement,
+                query['parameters'] or ()
+            )
+            plan = result.scalar()
+            conn.rollback()
+            return plan
+    except Exception as e:
+        return {'error': str(e)}
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'token':
+        secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+        print(f"{PROFILE_HEADER}: {make_profile_token(secret_key)}")
+    else:
+        print("Usage: python profiling.py token")
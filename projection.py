@@ -0,0 +1,162 @@
+"""Monte Carlo projection of how close a player is to levelling up.
+
+Each of the nine holes gets its own stroke distribution, built from the
+player's rounds at their current level with recent rounds weighted more
+heavily. Sampling 100,000 rounds from those distributions with NumPy gives
+the chance of shooting 36 or better next round. A player levels up on the
+first such round, so the expected number of rounds to level up is 1 / p.
+
+Projections are cached per user and keyed on (current_level, total_rounds),
+which changes with every round, so a cached projection is never stale.
+Callers that record a round recompute it once the round is committed (see
+refresh_after_round).
+"""
+
+import math
+import threading
+from collections import OrderedDict, namedtuple
+from db_models import db
+from round_views import holes_at_level
+
+SIMULATED_ROUNDS = 100_000
+TARGET_SCORE = 36
+MAX_LEVEL = 6
+MAX_STROKES = 10
+HOLES = 9
+# Fewer rounds than this at a level say too little about the player
+MIN_ROUNDS = 3
+# Most recent rounds at the current level used for the model
+HISTORY_LIMIT = 200
+# A round this many rounds old counts half as much as the latest one
+HALF_LIFE_ROUNDS = 10
+# Weight, in rounds, of the player's all-holes distribution in each hole's estimate
+PRIOR_ROUNDS = 2.0
+# Share of each observed score spread to one stroke either side
+NEIGHBOUR_SPREAD = 0.25
+PROJECTION_CACHE_MAX_USERS = 5000
+
+# user_id -> ((current_level, total_rounds), projection or None)
+_projection_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# What a projection depends on, as plain values that outlive the session's commit
+PlayerVersion = namedtuple('PlayerVersion', ['user_id', 'current_level', 'total_rounds'])
+
+
+def hole_distributions(rounds):
+    """Per-hole stroke probabilities from rounds given newest first.
+
+    Returns a (9, MAX_STROKES) array where [h, s] is the chance of taking
+    s + 1 strokes on hole h + 1. Each hole's own counts are blended with the
+    player's distribution over all holes, smoothed to neighbouring scores,
+    so a handful of rounds never rules a score out entirely.
+    """
+    # Imported here to keep NumPy out of app startup; later calls hit the module cache
+    import numpy as np
+
+    scores = np.asarray(rounds, dtype=np.int64).clip(1, MAX_STROKES) - 1
+    weights = 0.5 ** (np.arange(len(scores)) / HALF_LIFE_ROUNDS)
+
+    counts = np.zeros((HOLES, MAX_STROKES))
+    np.add.at(counts, (np.broadcast_to(np.arange(HOLES), scores.shape), scores), weights[:, None])
+
+    pooled = counts.sum(axis=0)
+    pooled = np.convolve(pooled, [NEIGHBOUR_SPREAD, 1 - 2 * NEIGHBOUR_SPREAD, NEIGHBOUR_SPREAD], mode='same')
+    pooled /= pooled.sum()
+
+    probabilities = counts + PRIOR_ROUNDS * pooled
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def simulate_totals(probabilities, n=SIMULATED_ROUNDS, rng=None):
+    """Sample n round totals from per-hole stroke probabilities.
+
+    Inverse-CDF sampling: a hole takes one stroke plus the number of CDF
+    thresholds its uniform draw exceeds. Each comparison runs over one
+    hole's contiguous float32 draws, and thresholds that every or no draw
+    exceeds are skipped, so 100,000 rounds take a few milliseconds.
+    """
+    import numpy as np
+
+    rng = rng if rng is not None else np.random.default_rng()
+    holes = probabilities.shape[0]
+    thresholds = np.cumsum(probabilities, axis=1)[:, :-1].astype(np.float32)
+    draws = rng.random((holes, n), dtype=np.float32)
+
+    totals = np.zeros(n, dtype=np.int16)
+    certain_strokes = holes
+    for hole in range(holes):
+        for threshold in thresholds[hole]:
+            if threshold <= 0:
+                certain_strokes += 1
+            elif threshold < 1:
+                totals += draws[hole] > threshold
+    return totals + certain_strokes
+
+
+def project(rounds, seed=None, n=SIMULATED_ROUNDS):
+    """Projection from rounds at the current level, newest first, or None if too few."""
+    if len(rounds) < MIN_ROUNDS:
+        return None
+    import numpy as np
+
+    probabilities = hole_distributions(rounds)
+    totals = simulate_totals(probabilities, n=n, rng=np.random.default_rng(seed))
+    chance = int(np.count_nonzero(totals <= TARGET_SCORE)) / n
+
+    if chance >= 1:
+        rounds_for_90_percent = 1
+    elif chance > 0:
+        rounds_for_90_percent = math.ceil(math.log(0.1) / math.log(1 - chance))
+    else:
+        rounds_for_90_percent = None
+
+    return {
+        'rounds_used': len(rounds),
+        'par_or_better_chance': chance,
+        'expected_rounds': 1 / chance if chance else None,
+        'rounds_for_90_percent': rounds_for_90_percent,
+        'expected_score': float(totals.mean()),
+    }
+
+
+def refresh_projection(profile):
+    """Recompute and cache a player's projection. Returns it (None if unavailable)."""
+    version = (profile.current_level, profile.total_rounds)
+    if profile.current_level >= MAX_LEVEL:
+        projection = None
+    else:
+        rounds = holes_at_level(profile.user_id, profile.current_level, HISTORY_LIMIT)
+        # Seeded by data version so every worker shows the same numbers
+        projection = project(rounds, seed=(profile.user_id, profile.total_rounds))
+
+    with _cache_lock:
+        _projection_cache[profile.user_id] = (version, projection)
+        _projection_cache.move_to_end(profile.user_id)
+        while len(_projection_cache) > PROJECTION_CACHE_MAX_USERS:
+            _projection_cache.popitem(last=False)
+    return projection
+
+
+def refresh_after_round(player):
+    """Recompute a projection after a round is committed, logging instead of raising.
+
+    The round is already stored, so a failure here must not fail or repeat the
+    submission; get_projection recomputes it on the next read. Pass a
+    PlayerVersion read in the same call_database as the commit: the
+    committed profile is expired and would be reloaded from the database.
+    """
+    try:
+        refresh_projection(player)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Projection warning: refreshing user {player.user_id} failed: {e}")
+
+
+def get_projection(profile):
+    """Cached projection for a player, recomputed if their rounds changed."""
+    with _cache_lock:
+        cached = _projection_cache.get(profile.user_id)
+    if cached and cached[0] == (profile.current_level, profile.total_rounds):
+        return cached[1]
+    return refresh_projection(profile)
@@ -0,0 +1,287 @@
+"""Bulk account provisioning for academies and clubs."""
+
+import csv
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.security import generate_password_hash
+from db_models import db, User, UserProfile, UserDirectory, ProvisionJob, shard_engine
+from sharding import place_new_user
+
+DEFAULT_BATCH_SIZE = 500
+MIN_PASSWORD_LENGTH = 6
+# DictReader key for values beyond the header's columns
+EXTRA_FIELDS = '_extra'
+INVITE_TOKEN_BYTES = 12
+# Enough for a random 96-bit token, which cannot be guessed from a dictionary
+INVITE_HASH_METHOD = 'pbkdf2:sha256:1000'
+INIT_DB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init_db.py')
+# A job still unfinished after this long is assumed to have died with its process
+PROVISION_JOB_MAX_AGE = timedelta(hours=2)
+
+
+def _decode_lines(data, errors):
+    """Decode uploaded bytes line by line, reporting lines that are not UTF-8."""
+    lines = []
+    for line_number, line in enumerate(data.splitlines(keepends=True), 1):
+        try:
+            lines.append(line.decode('utf-8-sig' if line_number == 1 else 'utf-8'))
+        except UnicodeDecodeError:
+            errors.append(f'Line {line_number}: not UTF-8 text')
+            # Keep the line count so later rows are reported at the right line
+            lines.append('\n')
+    return lines
+
+
+def read_students_csv(stream):
+    """Parse a student CSV with an `email` column and optional `password` column.
+
+    Returns (students, errors) where students is a list of (email, password)
+    tuples with duplicates removed and errors is a list of messages for rows
+    that were skipped. A blank password means an invite token is generated.
+    """
+    errors = []
+    if isinstance(stream, bytes):
+        stream = _decode_lines(stream, errors)
+
+    reader = csv.DictReader(stream, restkey=EXTRA_FIELDS)
+    try:
+        fieldnames = reader.fieldnames
+    except csv.Error as e:
+        return [], errors + [f'Could not read the CSV header: {e}']
+    if not fieldnames or 'email' not in [f.strip().lower() for f in fieldnames]:
+        return [], errors + ['CSV must have an "email" column']
+
+    students = []
+    seen = set()
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            errors.append(f'Line {reader.line_num}: {e}')
+            continue
+        line_number = reader.line_num
+
+        extra = [v for v in row.pop(EXTRA_FIELDS, []) if v.strip()]
+        if extra:
+            errors.append(f'Line {line_number}: more fields than the header')
+            continue
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        email = row.get('email', '').lower()
+        password = row.get('password', '')
+
+        if not email or '@' not in email:
+            errors.append(f'Line {line_number}: invalid email "{email}"')
+            continue
+        if email in seen:
+            errors.append(f'Line {line_number}: duplicate email {email}')
+            continue
+        if password and len(password) < MIN_PASSWORD_LENGTH:
+            errors.append(f'Line {line_number}: password for {email} is shorter than {MIN_PASSWORD_LENGTH} characters')
+            continue
+
+        seen.add(email)
+        students.append((email, password))
+
+    return students, errors
+
+
+def hash_credentials(students, workers=None):
+    """Hash passwords across a process pool and generate invite tokens.
+
+    Returns (hashed, invites) where hashed is a list of (email, password_hash)
+    and invites maps email to the plain invite token for students that were
+    not given a password. Invite tokens are long and random, so they get a
+    cheap hash; only chosen passwords need the slow default.
+    """
+    invites = {}
+    password_hashes = {}
+    passwords = []
+    for email, password in students:
+        if password:
+            passwords.append((email, password))
+        else:
+            invites[email] = secrets.token_urlsafe(INVITE_TOKEN_BYTES)
+            password_hashes[email] = generate_password_hash(invites[email], method=INVITE_HASH_METHOD)
+
+    if passwords:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(passwords) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(generate_password_hash, [p for _, p in passwords], chunksize=chunksize)
+            password_hashes.update(zip([email for email, _ in passwords], hashes))
+
+    hashed = [(email, password_hashes[email]) for email, _ in students]
+    return hashed, invites
+
+
+def insert_accounts(hashed, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert users and their profiles, one transaction per batch and shard.
+
+    Emails are claimed in the user directory first; existing ones are skipped
+    with ON CONFLICT DO NOTHING, so no per-row lookup is needed. The claimed
+    ids are then inserted on each account's shard. Returns the list of emails
+    that were created.
+    """
+    created = []
+    for start in range(0, len(hashed), batch_size):
+        batch = hashed[start:start + batch_size]
+        try:
+            entries = db.session.execute(
+                insert(UserDirectory)
+                .values([{'email': email, 'shard': place_new_user(email)} for email, _ in batch])
+                .on_conflict_do_nothing(index_elements=[UserDirectory.email])
+                .returning(UserDirectory.user_id, UserDirectory.email, UserDirectory.shard)
+            ).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        password_hashes = dict(batch)
+        by_shard = defaultdict(list)
+        for entry in entries:
+            by_shard[entry.shard].append(entry)
+
+        for shard, shard_entries in by_shard.items():
+            try:
+                with shard_engine(shard).begin() as conn:
+                    conn.execute(insert(User).values([
+                        {'id': entry.user_id, 'email': entry.email, 'password_hash': password_hashes[entry.email]}
+                        for entry in shard_entries
+                    ]))
+                    conn.execute(insert(UserProfile).values([{'user_id': entry.user_id} for entry in shard_entries]))
+            except Exception:
+                # Release the emails this shard did not take so they can be provisioned again
+                db.session.execute(
+                    delete(UserDirectory).where(UserDirectory.user_id.in_([entry.user_id for entry in shard_entries]))
+                )
+                db.session.commit()
+                raise
+            created.extend(entry.email for entry in shard_entries)
+
+    return created
+
+
+def provision_students(students, batch_size=DEFAULT_BATCH_SIZE, workers=None):
+    """Hash credentials and insert accounts, reporting throughput.
+
+    Must be called inside an application context.
+    """
+    started = time.perf_counter()
+    hashed, invites = hash_credentials(students, workers=workers)
+    hashed_at = time.perf_counter()
+    created = insert_accounts(hashed, batch_size=batch_size)
+    finished = time.perf_counter()
+
+    created_set = set(created)
+    elapsed = finished - started
+    return {
+        'rows': len(students),
+        'created': len(created),
+        'skipped': len(students) - len(created),
+        'hash_seconds': round(hashed_at - started, 3),
+        'insert_seconds': round(finished - hashed_at, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(len(students) / elapsed, 1) if elapsed > 0 else 0.0,
+        # Only hand out tokens for accounts that were actually created
+        'invites': {email: token for email, token in invites.items() if email in created_set},
+    }
+
+
+def active_provision_job():
+    """The queued or running job, if any; only one runs at a time."""
+    return ProvisionJob.query.filter(
+        ProvisionJob.status.in_(('queued', 'running')),
+        ProvisionJob.created_at > datetime.utcnow() - PROVISION_JOB_MAX_AGE,
+    ).first()
+
+
+def start_provision_job(students, batch_size=DEFAULT_BATCH_SIZE, created_by=None):
+    """Record a job and hand the students to an `init_db.py provision-job` process.
+
+    Hashing passwords for a large academy takes minutes, far longer than a
+    web request may run, so the accounts are created in a separate process
+    rather than in the web worker. Students go to it on stdin, so passwords
+    are never written to disk. Returns the ProvisionJob.
+    """
+    job = ProvisionJob(rows=len(students), created_by=created_by)
+    db.session.add(job)
+    db.session.commit()
+
+    payload = json.dumps({'students': students, 'batch_size': batch_size}).encode('utf-8')
+    try:
+        process = subprocess.Popen(
+            [sys.executable, INIT_DB_SCRIPT, 'provision-job', str(job.id)],
+            stdin=subprocess.PIPE, start_new_session=True,
+        )
+        process.stdin.write(payload)
+        process.stdin.close()
+    except OSError as e:
+        job.status = 'failed'
+        job.error = f'Could not start the provisioning process: {e}'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+
+def run_provision_job(job_id, payload, workers=None):
+    """Create the accounts for a queued job and record the report on it.
+
+    payload is the JSON start_provision_job sent. Must be called inside an
+    application context.
+    """
+    job = db.session.get(ProvisionJob, job_id)
+    if job is None or job.status != 'queued':
+        raise ValueError(f'Provisioning job {job_id} is not queued')
+    job.status = 'running'
+    db.session.commit()
+
+    try:
+        students = [tuple(student) for student in payload['students']]
+        report = provision_students(students, batch_size=payload['batch_size'], workers=workers)
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = f'{type(e).__name__}: {e}'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+    job.status = 'done'
+    job.report = report
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return report
+
+
+def provision_job_status(job):
+    """A job as JSON-ready data.
+
+    Invite tokens are included the first time a finished job is read, then
+    removed from the database.
+    """
+    status = {
+        'job_id': job.id,
+        'status': job.status,
+        'rows': job.rows,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error': job.error,
+        'report': job.report,
+    }
+    if job.report and job.report.get('invites'):
+        # Reassigned rather than mutated so the JSON column is saved
+        job.report = dict(job.report, invites={}, invites_collected=True)
+        db.session.commit()
+    return status
@@ -0,0 +1,506 @@
+"""Keeping the dashboard usable while the database is slow or down.
+
+Three pieces work together:
+
+- A circuit breaker around database calls. Postgres statement and connect
+  timeouts turn a latency spike into fast errors; after DB_BREAKER_FAILURES
+  consecutive errors the breaker opens and requests stop touching the
+  database until DB_BREAKER_RESET_SECONDS have passed, so sync workers are
+  never held for the whole gunicorn timeout.
+- Per-user snapshots of the progress, history and stats sections. Every
+  successful render saves its context; when the database is unavailable the
+  last snapshot is served with a "last updated" marker while a single
+  background worker revalidates it.
+- A durable local spool for score submissions. Rounds submitted during an
+  outage are written to a SQLite file and replayed in submission order once
+  the database recovers.
+
+The breaker and snapshots live in process memory, like the group rollup
+cache, so each gunicorn worker keeps its own. The spool is shared by every
+worker on the machine.
+"""
+
+import fcntl
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from flask import current_app, request
+from flask_login import UserMixin
+from sqlalchemy import exc
+from db_models import db, Round, UserProfile
+from projection import refresh_after_round, PlayerVersion
+from sharding import route_to_user
+
+# Errors that mean the database is unreachable or too slow, not that a query is wrong
+DATABASE_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError)
+
+# Users whose snapshots are kept per worker; the least recently used are dropped
+SNAPSHOT_MAX_USERS = 5000
+# Seconds between checks for spooled rounds to replay
+SPOOL_REPLAY_INTERVAL = 10
+# Snapshot refreshes waiting per worker; further ones are skipped until the queue drains
+REVALIDATION_QUEUE_SIZE = 100
+# Random extra wait before each refresh, so workers do not all retry at once
+REVALIDATION_JITTER_SECONDS = 2.0
+
+# Endpoints with an offline fallback; others fail fast with a 503 while the breaker is open
+OFFLINE_ENDPOINTS = {
+    'static', 'main.healthz', 'main.index', 'main.get_progress', 'main.get_history',
+    'main.get_stats', 'main.submit_score', 'main.logout',
+}
+# Pages that only need the database when their form is submitted
+OFFLINE_GET_ENDPOINTS = {'main.login', 'main.register'}
+
+
+class DatabaseUnavailable(Exception):
+    """The database timed out, errored, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated database errors, then lets a trial call through.
+
+    closed:    calls pass; failure_threshold consecutive failures open it
+    open:      calls are refused until reset_seconds have passed
+    half-open: one trial call passes and the rest are refused; its success
+               closes the breaker, its failure reopens it. A trial that never
+               reports back is replaced after another reset_seconds.
+    """
+
+    def __init__(self, failure_threshold=3, reset_seconds=15.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Whether a call may go ahead; in half-open state this claims the trial."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'open':
+                return False
+            now = self.clock()
+            if self.trial_started_at is not None and now - self.trial_started_at < self.reset_seconds:
+                return False
+            self.trial_started_at = now
+            return True
+
+    def seconds_until_retry(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - self.clock())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_started_at = None
+            # A failed trial call reopens the breaker straight away
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+db_breaker = CircuitBreaker()
+
+
+def call_database(func, *args, **kwargs):
+    """Run func through the circuit breaker.
+
+    Raises DatabaseUnavailable instead of waiting on a database that is
+    known to be down, or when func hits a timeout or connection error.
+    """
+    if not db_breaker.allow():
+        raise DatabaseUnavailable('circuit breaker is open')
+
+    try:
+        result = func(*args, **kwargs)
+    except DATABASE_ERRORS as e:
+        db_breaker.record_failure()
+        try:
+            db.session.rollback()
+        except DATABASE_ERRORS:
+            pass
+        raise DatabaseUnavailable(str(e)) from e
+
+    db_breaker.record_success()
+    return result
+
+
+def configure_database_timeouts(app):
+    """Add statement, connect and pool timeouts to the engine options.
+
+    Call before db.init_app(app). Only Postgres URLs get statement and
+    connect timeouts; they apply to every shard.
+    """
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options['pool_timeout'] = app.config['DB_POOL_TIMEOUT']
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args['connect_timeout'] = app.config['DB_CONNECT_TIMEOUT']
+        connect_args['options'] = f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']}"
+        options['connect_args'] = connect_args
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+# Context for one section, as plain data so it outlives the request's session
+Snapshot = namedtuple('Snapshot', ['context', 'updated_at'])
+
+
+class PlayerSnapshot:
+    """Stand-in for UserProfile in templates rendered from a snapshot."""
+
+    def __init__(self, user_id, current_level, total_rounds, rounds_at_current_level):
+        self.user_id = user_id
+        self.current_level = current_level
+        self.total_rounds = total_rounds
+        self.rounds_at_current_level = rounds_at_current_level
+
+    def get_rounds_at_current_level(self):
+        return self.rounds_at_current_level
+
+
+class SnapshotStore:
+    """Last good context per user and section, least recently used users dropped first."""
+
+    def __init__(self, max_users=SNAPSHOT_MAX_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, user_id, section, context):
+        with self._lock:
+            sections = self._entries.setdefault(user_id, {})
+            sections[section] = Snapshot(context, datetime.utcnow())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id, section):
+        with self._lock:
+            sections = self._entries.get(user_id)
+            if sections is None:
+                return None
+            self._entries.move_to_end(user_id)
+            return sections.get(section)
+
+
+snapshots = SnapshotStore()
+
+# (user_id, section) pairs queued or being refreshed by the revalidation worker
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+_revalidation_queue = queue.Queue(maxsize=REVALIDATION_QUEUE_SIZE)
+_revalidation_worker = None
+
+
+def _build_for_user(builder, user_id):
+    if route_to_user(user_id) is None:
+        raise LookupError(f"User {user_id} is not in the directory")
+    return builder(user_id)
+
+
+def _revalidate(app, user_id, section, builder):
+    try:
+        # Wait for the breaker to allow a trial rather than failing immediately
+        time.sleep(db_breaker.seconds_until_retry() + random.uniform(0, REVALIDATION_JITTER_SECONDS))
+        with app.app_context():
+            try:
+                snapshots.save(user_id, section, call_database(_build_for_user, builder, user_id))
+            except (DatabaseUnavailable, LookupError):
+                pass
+            finally:
+                db.session.remove()
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard((user_id, section))
+
+
+def _run_revalidations():
+    while True:
+        app, user_id, section, builder = _revalidation_queue.get()
+        try:
+            _revalidate(app, user_id, section, builder)
+        except Exception as e:
+            print(f"Snapshot warning: refreshing {section} for user {user_id} failed: {e}")
+
+
+def schedule_revalidation(app, user_id, section, builder):
+    """Queue a refresh of a user's snapshot for the background worker.
+
+    Returns False if it is already queued or the queue is full.
+    """
+    global _revalidation_worker
+    key = (user_id, section)
+    with _revalidating_lock:
+        if key in _revalidating:
+            return False
+        try:
+            _revalidation_queue.put_nowait((app, user_id, section, builder))
+        except queue.Full:
+            return False
+        _revalidating.add(key)
+        # Started on first use, so each gunicorn worker gets its own after the fork
+        if _revalidation_worker is None or not _revalidation_worker.is_alive():
+            _revalidation_worker = threading.Thread(target=_run_revalidations, daemon=True)
+            _revalidation_worker.start()
+    return True
+
+
+class OfflineUser(UserMixin):
+    """Logged-in user restored from the session while the database is unavailable."""
+
+    offline = True
+    profile = None
+
+    def __init__(self, user_id, email=''):
+        self.id = user_id
+        self.email = email
+
+
+SpooledRound = namedtuple('SpooledRound', ['id', 'user_id', 'holes', 'submitted_at'])
+
+
+class ScoreSpool:
+    """Durable queue of score submissions, kept in a local SQLite file.
+
+    Every write is fsynced before it returns, so an acknowledged round
+    survives a crash. Entries are replayed in insertion order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS spooled_rounds ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'user_id INTEGER NOT NULL, '
+            'holes TEXT NOT NULL, '
+            'submitted_at TEXT NOT NULL, '
+            'failed_at TEXT, '
+            'error TEXT)'
+        )
+        return conn
+
+    def append(self, user_id, holes, submitted_at=None):
+        """Store a round and return its spool id."""
+        submitted_at = submitted_at or datetime.utcnow()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'INSERT INTO spooled_rounds (user_id, holes, submitted_at) VALUES (?, ?, ?)',
+                (user_id, json.dumps(holes), submitted_at.isoformat())
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def pending(self, limit=100):
+        """Oldest rounds that have not been replayed or failed."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT id, user_id, holes, submitted_at FROM spooled_rounds '
+                'WHERE failed_at IS NULL ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            SpooledRound(row[0], row[1], json.loads(row[2]), datetime.fromisoformat(row[3]))
+            for row in rows
+        ]
+
+    def pending_count(self, user_id=None):
+        if not os.path.exists(self.path):
+            return 0
+        conn = self._connect()
+        try:
+            if user_id is None:
+                return conn.execute('SELECT count(*) FROM spooled_rounds WHERE failed_at IS NULL').fetchone()[0]
+            return conn.execute(
+                'SELECT count(*) FROM spooled_rounds WHERE failed_at IS NULL AND user_id = ?', (user_id,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def failed_count(self):
+        if not os.path.exists(self.path):
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT count(*) FROM spooled_rounds WHERE failed_at IS NOT NULL').fetchone()[0]
+        finally:
+            conn.close()
+
+    def remove(self, entry_id):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM spooled_rounds WHERE id = ?', (entry_id,))
+        finally:
+            conn.close()
+
+    def mark_failed(self, entry_id, error):
+        """Keep a round that cannot be replayed for inspection, out of the queue."""
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE spooled_rounds SET failed_at = ?, error = ? WHERE id = ?',
+                (datetime.utcnow().isoformat(), error, entry_id)
+            )
+        finally:
+            conn.close()
+
+
+def get_spool(app=None):
+    app = app or current_app
+    return ScoreSpool(app.config['SPOOL_PATH'])
+
+
+def _replay_round(entry):
+    if route_to_user(entry.user_id) is None:
+        raise LookupError(f"User {entry.user_id} is not in the directory")
+    profile = UserProfile.query.filter_by(user_id=entry.user_id).first()
+    if profile is None:
+        raise LookupError(f"User {entry.user_id} has no profile")
+
+    # A crash after the commit but before the spool entry was removed must not add it twice
+    already_recorded = db.session.query(
+        Round.query.filter_by(user_id=entry.user_id, played_at=entry.submitted_at).exists()
+    ).scalar()
+    if already_recorded:
+        db.session.rollback()
+        return None
+    profile.add_round(entry.holes, played_at=entry.submitted_at)
+    return PlayerVersion(entry.user_id, profile.current_level, profile.total_rounds)
+
+
+def replay_spool(app):
+    """Record spooled rounds in order. Returns (replayed, failed).
+
+    Stops at the first database error and leaves the rest for the next
+    attempt. Only one process replays at a time.
+    """
+    spool = get_spool(app)
+    if not os.path.exists(spool.path):
+        return 0, 0
+
+    with open(spool.path + '.lock', 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0, 0
+
+        replayed = failed = 0
+        with app.app_context():
+            try:
+                while True:
+                    entries = spool.pending()
+                    if not entries:
+                        break
+                    for entry in entries:
+                        try:
+                            player = call_database(_replay_round, entry)
+                        except DatabaseUnavailable:
+                            return replayed, failed
+                        except Exception as e:
+                            db.session.rollback()
+                            print(f"Spool warning: round {entry.id} for user {entry.user_id} failed: {e}")
+                            spool.mark_failed(entry.id, repr(e))
+                            failed += 1
+                            continue
+                        spool.remove(entry.id)
+                        replayed += 1
+                        if player is not None:
+                            refresh_after_round(player)
+            finally:
+                db.session.remove()
+                if replayed or failed:
+                    print(f"Spool replay: {replayed} round(s) recorded, {failed} failed")
+        return replayed, failed
+
+
+def init_resilience(app):
+    """Register the breaker settings, fail-fast check and spool replay hooks."""
+    db_breaker.failure_threshold = app.config['DB_BREAKER_FAILURES']
+    db_breaker.reset_seconds = app.config['DB_BREAKER_RESET_SECONDS']
+    state = {'last_replay_check': 0.0, 'replaying': False}
+
+    @app.before_request
+    def fail_fast_while_open():
+        # Only a closed check: allow() would spend the half-open trial on this request
+        if db_breaker.state != 'open':
+            return None
+        if request.endpoint in OFFLINE_ENDPOINTS:
+            return None
+        if request.method == 'GET' and request.endpoint in OFFLINE_GET_ENDPOINTS:
+            return None
+        return database_unavailable_response()
+
+    @app.errorhandler(DatabaseUnavailable)
+    def handle_database_unavailable(e):
+        return database_unavailable_response()
+
+    for error in DATABASE_ERRORS:
+        @app.errorhandler(error)
+        def handle_database_error(e):
+            db_breaker.record_failure()
+            return database_unavailable_response()
+
+    @app.after_request
+    def replay_spool_when_healthy(response):
+        now = time.monotonic()
+        if state['replaying'] or db_breaker.state != 'closed':
+            return response
+        if now - state['last_replay_check'] < SPOOL_REPLAY_INTERVAL:
+            return response
+        state['last_replay_check'] = now
+        if get_spool(app).pending_count() == 0:
+            return response
+
+        def run():
+            try:
+                replay_spool(app)
+            finally:
+                state['replaying'] = False
+
+        state['replaying'] = True
+        threading.Thread(target=run, daemon=True).start()
+        return response
+
+
+def database_unavailable_response():
+    return '''
+    <div class="p-4 rounded-lg bg-amber-50 border-l-4 border-amber-500">
+        <p class="font-semibold text-amber-700">Temporarily unavailable</p>
+        <p class="text-sm text-amber-600 mt-1">We can't reach the database right now. Please try again in a moment.</p>
+    </div>
+    ''', 503, {'Retry-After': str(max(1, round(db_breaker.seconds_until_retry())))}
@@ -0,0 +1,164 @@
+"""Group dashboard rollups built from set-based queries and cached per data version."""
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from db_models import db, User, UserProfile, Round, GroupMember, UserDirectory, shard_engine
+
+INACTIVE_DAYS = 14
+RECENT_LEVEL_UP_DAYS = 14
+RECENT_LEVEL_UP_LIMIT = 20
+# Inactivity depends on the clock, not just member data, so cap rollup age too
+ROLLUP_MAX_AGE_SECONDS = 3600
+ROLLUP_CACHE_MAX_GROUPS = 500
+
+# group_id -> (data_version, built_at, rollup); least recently used groups are dropped first
+_rollup_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_group_rollup(group):
+    """Return the dashboard rollup for a group, rebuilding it if stale."""
+    current_version = group.current_version()
+    with _cache_lock:
+        cached = _rollup_cache.get(group.id)
+        if cached:
+            _rollup_cache.move_to_end(group.id)
+    if cached:
+        version, built_at, rollup = cached
+        if version == current_version and time.monotonic() - built_at < ROLLUP_MAX_AGE_SECONDS:
+            return rollup
+
+    rollup = build_group_rollup(group.id)
+    rollup['data_version'] = current_version
+    with _cache_lock:
+        _rollup_cache[group.id] = (current_version, time.monotonic(), rollup)
+        _rollup_cache.move_to_end(group.id)
+        while len(_rollup_cache) > ROLLUP_CACHE_MAX_GROUPS:
+            _rollup_cache.popitem(last=False)
+    return rollup
+
+
+def build_group_rollup(group_id):
+    """Aggregate a group's students with a directory query plus two per shard, regardless of group size."""
+    now = datetime.utcnow()
+    inactive_cutoff = now - timedelta(days=INACTIVE_DAYS)
+    level_up_cutoff = now - timedelta(days=RECENT_LEVEL_UP_DAYS)
+
+    members = db.session.execute(
+        db.select(UserDirectory.user_id, UserDirectory.email, UserDirectory.shard)
+        .join(GroupMember, GroupMember.user_id == UserDirectory.user_id)
+        .where(GroupMember.group_id == group_id, GroupMember.role == 'student')
+        .order_by(UserDirectory.email)
+    ).all()
+
+    ids_by_shard = defaultdict(list)
+    emails = {}
+    for member in members:
+        ids_by_shard[member.shard].append(member.user_id)
+        emails[member.user_id] = member.email
+
+    stats_by_user = {}
+    level_up_rows = []
+    for shard, student_ids in ids_by_shard.items():
+        bind_arguments = {'bind': shard_engine(shard)}
+
+        round_stats = db.select(
+            Round.user_id,
+            func.count(Round.id).label('rounds'),
+            func.sum(Round.total).label('strokes'),
+            func.min(Round.total).label('best_score'),
+            func.max(Round.played_at).label('last_played')
+        ).where(Round.user_id.in_(student_ids)).group_by(Round.user_id).subquery()
+
+        for row in db.session.execute(
+            db.select(
+                User.id,
+                UserProfile.current_level,
+                round_stats.c.rounds,
+                round_stats.c.strokes,
+                round_stats.c.best_score,
+                round_stats.c.last_played
+            )
+            .outerjoin(UserProfile, UserProfile.user_id == User.id)
+            .outerjoin(round_stats, round_stats.c.user_id == User.id)
+            .where(User.id.in_(student_ids)),
+            bind_arguments=bind_arguments
+        ):
+            stats_by_user[row.id] = row
+
+        # leveled_up is also set for par rounds at the max level, so exclude those
+        level_up_rows.extend(db.session.execute(
+            db.select(Round.user_id, Round.level, Round.total, Round.played_at)
+            .where(
+                Round.user_id.in_(student_ids),
+                Round.leveled_up.is_(True),
+                Round.level < 6,
+                Round.played_at >= level_up_cutoff
+            )
+            .order_by(Round.played_at.desc())
+            .limit(RECENT_LEVEL_UP_LIMIT),
+            bind_arguments=bind_arguments
+        ).all())
+
+    level_up_rows.sort(key=lambda row: row.played_at, reverse=True)
+    level_up_rows = level_up_rows[:RECENT_LEVEL_UP_LIMIT]
+
+    level_distribution = {level: 0 for level in range(1, 7)}
+    students = []
+    inactive_students = []
+    total_rounds = 0
+    total_strokes = 0
+    best_score = None
+
+    for member in members:
+        row = stats_by_user.get(member.user_id)
+        if row is None:
+            # Directory entry whose rows are mid-move or missing
+            continue
+        level = row.current_level or 1
+        rounds = row.rounds or 0
+        level_distribution[level] = level_distribution.get(level, 0) + 1
+        total_rounds += rounds
+        total_strokes += row.strokes or 0
+        if row.best_score is not None and (best_score is None or row.best_score < best_score):
+            best_score = row.best_score
+
+        inactive = row.last_played is None or row.last_played < inactive_cutoff
+        student = {
+            'user_id': row.id,
+            'email': member.email,
+            'current_level': level,
+            'total_rounds': rounds,
+            'average_score': (row.strokes / rounds) if rounds else 0.0,
+            'best_score': row.best_score or 0,
+            'last_played': row.last_played,
+            'inactive': inactive,
+        }
+        students.append(student)
+        if inactive:
+            inactive_students.append(student)
+
+    return {
+        'group_id': group_id,
+        'computed_at': now,
+        'student_count': len(students),
+        'level_distribution': level_distribution,
+        'total_rounds': total_rounds,
+        'average_score': (total_strokes / total_rounds) if total_rounds else 0.0,
+        'best_score': best_score or 0,
+        'students': students,
+        'recent_level_ups': [
+            {
+                'email': emails[row.user_id],
+                'from_level': row.level,
+                'to_level': row.level + 1,
+                'total': row.total,
+                'played_at': row.played_at,
+            }
+            for row in level_up_rows
+        ],
+        'inactive_students': inactive_students,
+    }
@@ -0,0 +1,58 @@
+"""Read-only round queries that skip the ORM.
+
+The dashboard only reads a handful of columns from each round. Loading Round
+objects for that pays for identity-map bookkeeping, attribute instrumentation
+and change tracking the templates never use. These queries select just the
+needed columns from the rounds table with SQLAlchemy Core and return compact
+RoundView tuples with the holes already decoded. They are plain data, so
+they go into snapshots (see resilience.py) as they are.
+
+Statements are built once at import with bound parameters, and run on
+db.session so they use its transaction and shard routing. Writes still go
+through the models in db_models.py.
+"""
+
+import json
+from collections import namedtuple
+from sqlalchemy import select, bindparam
+from db_models import db, Round
+
+rounds = Round.__table__
+
+RoundView = namedtuple('RoundView', ['level', 'total', 'leveled_up', 'played_at', 'holes'])
+
+_recent_rounds = (
+    select(rounds.c.level, rounds.c.total, rounds.c.leveled_up, rounds.c.played_at, rounds.c.holes)
+    .where(rounds.c.user_id == bindparam('user_id'))
+    .order_by(rounds.c.played_at.desc())
+    .limit(bindparam('limit'))
+)
+
+_holes_at_level = (
+    select(rounds.c.holes)
+    .where(rounds.c.user_id == bindparam('user_id'), rounds.c.level == bindparam('level'))
+    .order_by(rounds.c.played_at.desc())
+    .limit(bindparam('limit'))
+)
+
+
+def decode_holes(holes):
+    """Holes as a list; some early rounds stored them as a JSON-encoded string."""
+    if isinstance(holes, str):
+        return json.loads(holes)
+    return holes
+
+
+def recent_rounds(user_id, limit=10):
+    """A user's latest rounds as RoundView tuples, newest first."""
+    result = db.session.execute(_recent_rounds, {'user_id': user_id, 'limit': limit})
+    return [
+        RoundView(level, total, leveled_up, played_at, decode_holes(holes))
+        for level, total, leveled_up, played_at, holes in result
+    ]
+
+
+def holes_at_level(user_id, level, limit):
+    """Hole scores of a user's latest rounds at a level, newest first."""
+    result = db.session.execute(_holes_at_level, {'user_id': user_id, 'level': level, 'limit': limit})
+    return [decode_holes(holes) for holes in result.scalars()]
@@ -0,0 +1,339 @@
+"""User-based sharding for Learn to Golf Tracker.
+
+Every query on users, user_profiles and rounds is for one user, so those
+tables are split across databases by user. The main database (DATABASE_URL)
+holds the user_directory, which maps each email and user id to its shard,
+plus groups and migrations; it is also the 'default' shard. Extra shards
+come from SHARD_URLS and are registered as Flask-SQLAlchemy binds named
+shard_1, shard_2, ...
+
+Requests are routed by setting the shard on db.session (see use_shard);
+ShardedSession then sends per-user tables to that shard's engine. Without
+SHARD_URLS there is a single shard and no routing or directory lookups on
+the request path.
+"""
+
+import os
+import zlib
+from collections import Counter
+from flask import current_app
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from db_models import db, User, UserProfile, Round, UserDirectory, DEFAULT_SHARD, shard_engine
+
+# Round and profile id sequences step by this much, offset by shard index, so
+# ids never collide when a user's rows move to another shard
+MAX_SHARDS = 64
+# Rows copied per INSERT when moving a user
+MOVE_BATCH_SIZE = 1000
+
+
+def normalize_database_url(url):
+    """Use the psycopg 3 driver for plain postgresql:// URLs (as Supabase provides)."""
+    if url.startswith('postgresql://'):
+        return url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    return url
+
+
+def configure_shards(app):
+    """Register SHARD_URLS as binds. Call before db.init_app(app)."""
+    shard_urls = [url.strip() for url in os.environ.get('SHARD_URLS', '').split(',') if url.strip()]
+    if len(shard_urls) >= MAX_SHARDS:
+        raise ValueError(f"At most {MAX_SHARDS - 1} extra shards are supported")
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = [DEFAULT_SHARD]
+    for index, url in enumerate(shard_urls, 1):
+        key = f'shard_{index}'
+        binds[key] = normalize_database_url(url)
+        keys.append(key)
+
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.config['SHARD_KEYS'] = keys
+    # Shards that receive new accounts, e.g. to stop placing users on a full shard
+    new_user_shards = [key.strip() for key in os.environ.get('SHARD_NEW_USERS', '').split(',') if key.strip()]
+    unknown = set(new_user_shards) - set(keys)
+    if unknown:
+        raise ValueError(f"SHARD_NEW_USERS names unknown shards: {', '.join(sorted(unknown))}")
+    app.config['SHARD_NEW_USERS'] = new_user_shards or keys
+
+
+def shard_keys():
+    """All shard keys, the default shard first."""
+    return current_app.config.get('SHARD_KEYS', [DEFAULT_SHARD])
+
+
+def is_sharded():
+    return len(shard_keys()) > 1
+
+
+def shard_index(shard):
+    return shard_keys().index(shard)
+
+
+def place_new_user(email):
+    """Pick the shard for a new account from a stable hash of its email."""
+    candidates = current_app.config.get('SHARD_NEW_USERS', [DEFAULT_SHARD])
+    return candidates[zlib.crc32(email.encode('utf-8')) % len(candidates)]
+
+
+def use_shard(shard):
+    """Route this session's per-user queries to a shard."""
+    db.session.info['shard'] = shard
+
+
+def route_to_user(user_id):
+    """Route the session to the shard holding a user. Returns the shard key or None."""
+    if not is_sharded():
+        use_shard(DEFAULT_SHARD)
+        return DEFAULT_SHARD
+
+    shard = db.session.execute(
+        select(UserDirectory.shard).where(UserDirectory.user_id == user_id)
+    ).scalar()
+    if shard is not None:
+        use_shard(shard)
+    return shard
+
+
+def find_user_by_email(email):
+    """Look an email up in the directory and load the user from its shard."""
+    entry = db.session.execute(
+        select(UserDirectory.user_id, UserDirectory.shard).where(UserDirectory.email == email)
+    ).first()
+    if entry is None:
+        return _adopt_unlisted_user(email)
+    use_shard(entry.shard)
+    return db.session.get(User, entry.user_id)
+
+
+def _adopt_unlisted_user(email):
+    """Find an account on the main database that has no directory entry, and add one.
+
+    The previous release keeps creating accounts straight in users during a
+    rolling deploy, after migration 5 copied the table; sync_directory adds
+    them all, this covers their logins until it has run.
+    """
+    use_shard(DEFAULT_SHARD)
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        return None
+    db.session.execute(
+        insert(UserDirectory)
+        .values(user_id=user.id, email=user.email, shard=DEFAULT_SHARD, created_at=user.created_at)
+        .on_conflict_do_nothing()
+    )
+    _advance_directory_sequence(db.session)
+    db.session.commit()
+    return user
+
+
+def _advance_directory_sequence(conn):
+    """Move the directory's id sequence past every id it holds, never backwards."""
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('user_directory', 'user_id')")).scalar()
+    conn.execute(text(
+        f"SELECT setval('{sequence}', greatest((SELECT coalesce(max(user_id), 1) FROM user_directory), "
+        f"(SELECT last_value FROM {sequence})))"
+    ))
+
+
+def sync_directory():
+    """Add directory entries for accounts on the main database that lack one. Returns how many.
+
+    Run once a deploy has finished: until then the previous release may
+    still create accounts without entries. Safe to repeat.
+    """
+    with db.engine.begin() as conn:
+        added = conn.execute(text(
+            "INSERT INTO user_directory (user_id, email, shard, created_at) "
+            "SELECT id, email, :shard, created_at FROM users "
+            "WHERE id NOT IN (SELECT user_id FROM user_directory) "
+            "ON CONFLICT DO NOTHING"
+        ), {'shard': DEFAULT_SHARD}).rowcount
+        _advance_directory_sequence(conn)
+    return added
+
+
+def register_user(email, password):
+    """Create a directory entry, user and profile. Returns None if the email is taken.
+
+    The email is claimed in the directory first, then the user is inserted on
+    its shard; if that fails the claim is removed again, as in provisioning.py.
+    """
+    shard = place_new_user(email)
+    user_id = db.session.execute(
+        insert(UserDirectory)
+        .values(email=email, shard=shard)
+        .on_conflict_do_nothing(index_elements=[UserDirectory.email])
+        .returning(UserDirectory.user_id)
+    ).scalar()
+    db.session.commit()
+    if user_id is None:
+        return None
+
+    try:
+        use_shard(shard)
+        user = User(id=user_id, email=email)
+        user.set_password(password)
+        user.profile = UserProfile()
+        db.session.add(user)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Release the email the shard did not take so it can be registered again
+        db.session.execute(delete(UserDirectory).where(UserDirectory.user_id == user_id))
+        db.session.commit()
+        raise
+    return user
+
+
+def _copy_rows(table, rows, target):
+    for start in range(0, len(rows), MOVE_BATCH_SIZE):
+        target.execute(table.insert(), rows[start:start + MOVE_BATCH_SIZE])
+
+
+def _delete_user_rows(conn, user_id):
+    conn.execute(delete(Round.__table__).where(Round.__table__.c.user_id == user_id))
+    conn.execute(delete(UserProfile.__table__).where(UserProfile.__table__.c.user_id == user_id))
+    conn.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+
+
+def move_user(user_id, target_shard):
+    """Move one user's rows to another shard while the app keeps serving.
+
+    The user's rows are locked on the source shard for the length of the copy,
+    so an in-flight score submission finishes first and new ones wait; once
+    the directory points at the target they fail and can be retried there.
+    Safe to re-run after a failure at any step. Returns True if rows moved.
+    """
+    if target_shard not in shard_keys():
+        raise ValueError(f"Unknown shard {target_shard}")
+
+    source_shard = db.session.execute(
+        select(UserDirectory.shard).where(UserDirectory.user_id == user_id)
+    ).scalar()
+    db.session.rollback()
+    if source_shard is None:
+        raise ValueError(f"User {user_id} is not in the directory")
+
+    if source_shard == target_shard:
+        # A previous run may have stopped after switching the directory
+        for shard in shard_keys():
+            if shard != target_shard:
+                with shard_engine(shard).begin() as conn:
+                    _delete_user_rows(conn, user_id)
+        return False
+
+    users = User.__table__
+    profiles = UserProfile.__table__
+    rounds = Round.__table__
+
+    with shard_engine(source_shard).connect() as source:
+        user = source.execute(
+            select(users).where(users.c.id == user_id).with_for_update()
+        ).mappings().first()
+        if user is None:
+            raise ValueError(f"User {user_id} has no rows on shard {source_shard}")
+        profile_rows = source.execute(
+            select(profiles).where(profiles.c.user_id == user_id).with_for_update()
+        ).mappings().all()
+        round_rows = source.execute(
+            select(rounds).where(rounds.c.user_id == user_id).order_by(rounds.c.id)
+        ).mappings().all()
+
+        with shard_engine(target_shard).begin() as target:
+            # Clear leftovers from an interrupted earlier attempt
+            _delete_user_rows(target, user_id)
+            target.execute(users.insert(), [dict(user)])
+            # Profile ids are not referenced anywhere, so let the target assign them
+            _copy_rows(profiles, [{k: v for k, v in dict(row).items() if k != 'id'} for row in profile_rows], target)
+            # Round ids are unique across shards (see interleave_id_sequences)
+            _copy_rows(rounds, [dict(row) for row in round_rows], target)
+
+        with db.engine.begin() as directory:
+            directory.execute(
+                UserDirectory.__table__.update()
+                .where(UserDirectory.__table__.c.user_id == user_id)
+                .values(shard=target_shard)
+            )
+
+        _delete_user_rows(source, user_id)
+        source.commit()
+
+    return True
+
+
+def shard_user_counts():
+    """Number of directory entries per shard, including empty shards."""
+    counts = Counter({shard: 0 for shard in shard_keys()})
+    counts.update(dict(db.session.execute(
+        select(UserDirectory.shard, func.count()).group_by(UserDirectory.shard)
+    ).all()))
+    db.session.rollback()
+    return counts
+
+
+def rebalance(max_moves=100):
+    """Move users from the fullest to the emptiest shard until counts are even.
+
+    Returns a list of (user_id, source, target) moves.
+    """
+    counts = shard_user_counts()
+    moves = []
+    while len(moves) < max_moves:
+        fullest, most = counts.most_common()[0]
+        emptiest, fewest = counts.most_common()[-1]
+        if most - fewest <= 1:
+            break
+
+        # Newest accounts first: they have the fewest rounds to copy
+        user_id = db.session.execute(
+            select(UserDirectory.user_id)
+            .where(UserDirectory.shard == fullest)
+            .order_by(UserDirectory.user_id.desc())
+            .limit(1)
+        ).scalar()
+        db.session.rollback()
+        if user_id is None:
+            break
+
+        move_user(user_id, emptiest)
+        moves.append((user_id, fullest, emptiest))
+        counts[fullest] -= 1
+        counts[emptiest] += 1
+    return moves
+
+
+def _sequence_name(conn, table):
+    return conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}).scalar()
+
+
+def interleave_id_sequences():
+    """Make round and profile ids unique across shards.
+
+    Restarts each shard's sequences above the highest id on any shard, then
+    steps them by MAX_SHARDS with the shard index as offset. Run after adding
+    a shard, before the new shard takes writes.
+    """
+    tables = ('rounds', 'user_profiles')
+    highest = 0
+    for shard in shard_keys():
+        with shard_engine(shard).connect() as conn:
+            for table in tables:
+                # Values already handed out may not be committed yet, so check the sequence too
+                highest = max(
+                    highest,
+                    conn.execute(text(f'SELECT coalesce(max(id), 0) FROM {table}')).scalar(),
+                    conn.execute(text(f'SELECT last_value FROM {_sequence_name(conn, table)}')).scalar()
+                )
+
+    floor = (highest // MAX_SHARDS + 1) * MAX_SHARDS
+    for shard in shard_keys():
+        start = floor + shard_index(shard)
+        with shard_engine(shard).begin() as conn:
+            for table in tables:
+                conn.exec_driver_sql(
+                    f'ALTER SEQUENCE {_sequence_name(conn, table)} INCREMENT BY {MAX_SHARDS} RESTART WITH {start}'
+                )
+        print(f"  {shard}: ids start at {start}, step {MAX_SHARDS}")
+    return floor
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Tests for the Parquet export, given pyarrow and a scratch Postgres database.
+
+They run only when TEST_DATABASE_URL is set, and drop and recreate the public
+schema of that database, so never point it at real data.
+"""
+
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, text
+import export
+from migrations import ROLE_MAIN, run_migrations
+from sharding import normalize_database_url
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'set TEST_DATABASE_URL to a scratch Postgres database')
+@unittest.skipUnless(pq, 'the export needs pyarrow')
+class TestExportRecovery(unittest.TestCase):
+    """Test that an export that dies part way through never duplicates rounds."""
+
+    def setUp(self):
+        self.engine = create_engine(normalize_database_url(TEST_DATABASE_URL))
+        self.reset_schema()
+        run_migrations(self.engine, ROLE_MAIN)
+        self.add_rounds(5)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.out_dir = self.tmp.name
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+        environ['DATABASE_URL'] = TEST_DATABASE_URL
+        self.env = mock.patch.dict(os.environ, environ, clear=True)
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+        self.reset_schema()
+        self.engine.dispose()
+
+    def reset_schema(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+            conn.exec_driver_sql('CREATE SCHEMA public')
+
+    def add_rounds(self, count, inserted_at="now() - interval '1 hour'"):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO users (id, email, password_hash) VALUES (1, 'a@example.com', 'x') "
+                "ON CONFLICT DO NOTHING"
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO user_profiles (user_id, current_level, total_rounds) "
+                "SELECT 1, 1, 0 WHERE NOT EXISTS (SELECT 1 FROM user_profiles)"
+            )
+            for _ in range(count):
+                conn.execute(text(
+                    "INSERT INTO rounds (user_id, level, holes, total, leveled_up, played_at, inserted_at) "
+                    "VALUES (1, 1, '[4, 4, 4, 4, 4, 4, 4, 4, 4]', 36, true, now() - interval '1 hour', "
+                    f"{inserted_at})"
+                ))
+
+    def exported_ids(self):
+        ids = []
+        for path in glob.glob(os.path.join(self.out_dir, 'rounds', '*', '*.parquet')):
+            ids.extend(pq.read_table(path).column('id').to_pylist())
+        return sorted(ids)
+
+    def test_profile_failure_keeps_committed_rounds(self):
+        """Test that rounds committed before a later step fails are not exported again."""
+        with mock.patch.object(export, 'export_profiles', side_effect=RuntimeError('killed')):
+            with self.assertRaises(RuntimeError):
+                export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5])
+
+        self.add_rounds(2)
+        export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_death_before_renames_is_finished_by_next_run(self):
+        """Test that renames recorded with the watermark are completed, not redone."""
+        with mock.patch.object(export, 'apply_pending', side_effect=[None, RuntimeError('killed')]):
+            with self.assertRaises(RuntimeError):
+                export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [])
+
+        export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5])
+        self.assertEqual(glob.glob(os.path.join(self.out_dir, '*', '*', '*.tmp')), [])
+
+    def test_death_before_watermark_discards_files(self):
+        """Test that files written before the watermark was saved are dropped and redone."""
+        with mock.patch.object(export, 'save_watermark', side_effect=RuntimeError('killed')):
+            with self.assertRaises(RuntimeError):
+                export.run_export(self.out_dir)
+        self.assertEqual(len(glob.glob(os.path.join(self.out_dir, 'rounds', '*', '*.tmp'))), 1)
+
+        export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5])
+        self.assertEqual(glob.glob(os.path.join(self.out_dir, '*', '*', '*.tmp')), [])
+
+    def test_recently_inserted_round_waits_despite_old_played_at(self):
+        """Test that a replayed round with an old played_at does not move the watermark past it."""
+        self.add_rounds(1, inserted_at='DEFAULT')
+        export.run_export(self.out_dir)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5])
+
+        export.run_export(self.out_dir, lag_minutes=0)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5, 6])
+
+    def test_rerun_replaces_same_day_profile_snapshot(self):
+        """Test that two runs on one day leave a single snapshot of each profile."""
+        export.run_export(self.out_dir)
+        export.run_export(self.out_dir, full=True)
+        paths = glob.glob(os.path.join(self.out_dir, 'user_profiles', '*', '*.parquet'))
+        self.assertEqual(sum(pq.read_table(path).num_rows for path in paths), 1)
+
+    def test_full_export_replaces_files(self):
+        """Test that --full leaves exactly one copy of every round."""
+        export.run_export(self.out_dir)
+        self.add_rounds(1)
+        export.run_export(self.out_dir, full=True)
+        self.assertEqual(self.exported_ids(), [1, 2, 3, 4, 5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
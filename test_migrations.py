@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Tests for the index audit and, given a scratch Postgres database, the migrations.
+
+The migration tests run only when TEST_DATABASE_URL is set. They drop and
+recreate the public schema of that database, so never point it at real data.
+"""
+
+import os
+import unittest
+from sqlalchemy import create_engine, text
+from migrations import (MIGRATIONS, BASELINE_SCHEMA, EXPECTED_INDEXES, ROLE_MAIN, ROLE_SHARD, analyze_indexes,
+                        run_migrations, migration_status, audit_indexes)
+from sharding import normalize_database_url
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+def index(table, name, columns, scans=10, unique=False, primary=False, valid=True, predicate=None):
+    return {
+        'table_name': table, 'index_name': name, 'idx_scan': scans, 'indisunique': unique,
+        'indisprimary': primary, 'indisvalid': valid, 'size_bytes': 8192, 'predicate': predicate,
+        'has_expression': False, 'columns': tuple(columns),
+    }
+
+
+class TestAnalyzeIndexes(unittest.TestCase):
+    """Test classifying indexes from pg_stat_user_indexes rows."""
+
+    def test_unused_skips_unique_and_primary(self):
+        """Test that only unscanned plain indexes are reported unused."""
+        report = analyze_indexes([
+            index('rounds', 'rounds_pkey', ['id'], scans=0, unique=True, primary=True),
+            index('users', 'ix_users_email', ['email'], scans=0, unique=True),
+            index('rounds', 'ix_rounds_played_at', ['played_at'], scans=0),
+        ], tables=set())
+        self.assertEqual([u['index'] for u in report['unused']], ['ix_rounds_played_at'])
+
+    def test_prefix_and_identical_duplicates(self):
+        """Test that a prefix of another index, or a copy of a unique one, is a duplicate."""
+        report = analyze_indexes([
+            index('rounds', 'ix_rounds_user_id', ['user_id']),
+            index('rounds', 'idx_rounds_user_played', ['user_id', 'played_at']),
+            index('users', 'ix_users_email', ['email'], unique=True),
+            index('users', 'idx_users_email', ['email']),
+        ], tables=set())
+        self.assertEqual(
+            sorted((d['index'], d['covered_by']) for d in report['duplicate']),
+            [('idx_users_email', 'ix_users_email'), ('ix_rounds_user_id', 'idx_rounds_user_played')]
+        )
+
+    def test_identical_pair_reported_once(self):
+        """Test that of two identical non-unique indexes only one is reported."""
+        report = analyze_indexes([
+            index('rounds', 'a_rounds_level', ['level']),
+            index('rounds', 'b_rounds_level', ['level']),
+        ], tables=set())
+        self.assertEqual([(d['index'], d['covered_by']) for d in report['duplicate']],
+                         [('b_rounds_level', 'a_rounds_level')])
+
+    def test_partial_and_invalid_indexes_do_not_count(self):
+        """Test that partial or invalid indexes neither cover nor duplicate others."""
+        report = analyze_indexes([
+            index('rounds', 'ix_rounds_user_id', ['user_id']),
+            index('rounds', 'idx_rounds_user_played', ['user_id', 'played_at'], valid=False),
+            index('rounds', 'idx_rounds_user_level', ['user_id', 'level'], predicate='(level > 1)'),
+        ], tables={'rounds'})
+        self.assertEqual(report['duplicate'], [])
+        missing = [tuple(m['columns']) for m in report['missing']]
+        self.assertIn(('user_id', 'played_at'), missing)
+        self.assertIn(('user_id', 'level'), missing)
+
+    def test_missing_limited_to_tables(self):
+        """Test that expected indexes are only checked on the tables given."""
+        report = analyze_indexes([], tables={'user_profiles'})
+        self.assertEqual([m['table'] for m in report['missing']], ['user_profiles'])
+        report = analyze_indexes([], tables={table for table, _, _ in EXPECTED_INDEXES})
+        self.assertEqual(len(report['missing']), len(EXPECTED_INDEXES))
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'set TEST_DATABASE_URL to a scratch Postgres database')
+class TestMigrations(unittest.TestCase):
+    """Test that fresh and legacy databases end up with the same schema."""
+
+    def setUp(self):
+        self.engine = create_engine(normalize_database_url(TEST_DATABASE_URL))
+        self.reset_schema()
+
+    def tearDown(self):
+        self.reset_schema()
+        self.engine.dispose()
+
+    def reset_schema(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+            conn.exec_driver_sql('CREATE SCHEMA public')
+
+    def schema(self):
+        with self.engine.connect() as conn:
+            columns = conn.execute(text(
+                "SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name <> 'schema_migrations' "
+                "ORDER BY table_name, column_name"
+            )).all()
+            indexes = conn.execute(text(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = 'public' "
+                "AND tablename <> 'schema_migrations' ORDER BY indexname"
+            )).all()
+        return columns, indexes
+
+    def test_fresh_database_matches_upgraded_legacy_one(self):
+        """Test that a database from the pre-migration init_db migrates to the same schema."""
+        run_migrations(self.engine, ROLE_MAIN)
+        fresh = self.schema()
+        self.assertTrue(all(applied for _, _, applied in migration_status(self.engine)))
+        self.assertEqual(audit_indexes(self.engine, ROLE_MAIN)['missing'], [])
+
+        self.reset_schema()
+        with self.engine.begin() as conn:
+            # What create_all plus the old init_db indexes produced
+            for _, statements in BASELINE_SCHEMA:
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+            conn.exec_driver_sql('CREATE INDEX idx_users_email ON users(email)')
+            conn.exec_driver_sql('CREATE INDEX idx_rounds_user_played ON rounds(user_id, played_at DESC)')
+            conn.exec_driver_sql("INSERT INTO users (email, password_hash) VALUES ('a@example.com', 'x')")
+            conn.exec_driver_sql(
+                "INSERT INTO rounds (user_id, level, holes, total, leveled_up) "
+                "VALUES (1, 1, '\"[4, 4, 4, 4, 4, 4, 4, 4, 4]\"', 36, true)"
+            )
+        run_migrations(self.engine, ROLE_MAIN)
+
+        self.assertEqual(self.schema(), fresh)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text('SELECT json_typeof(holes) FROM rounds')).scalar(), 'array')
+            self.assertEqual(conn.execute(text('SELECT user_id FROM user_directory')).scalar(), 1)
+
+    def test_shard_gets_only_per_user_tables(self):
+        """Test that a shard database holds only users, profiles and rounds."""
+        applied = run_migrations(self.engine, ROLE_SHARD)
+        self.assertEqual(applied, [version for version, _, _ in MIGRATIONS])
+        with self.engine.connect() as conn:
+            tables = set(conn.execute(text(
+                "SELECT tablename FROM pg_tables WHERE schemaname = 'public'"
+            )).scalars())
+        self.assertEqual(tables, {'users', 'user_profiles', 'rounds', 'schema_migrations'})
+        self.assertEqual(run_migrations(self.engine, ROLE_SHARD), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
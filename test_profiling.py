@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Tests for on-demand request profiling."""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from flask import Flask, render_template_string
+from sqlalchemy import create_engine, text
+from profiling import (init_profiling, make_profile_token, summarize_timings, prune_profiles,
+                       PROFILE_HEADER)
+
+
+def make_app(profiles_dir, **config):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test-secret', PROFILING_DIR=profiles_dir, **config)
+    engine = create_engine('sqlite://')
+
+    @app.route('/work')
+    def work():
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1')).scalar()
+        return render_template_string('{{ value }}', value='done')
+
+    return app
+
+
+class TestInitProfiling(unittest.TestCase):
+    """Test enabling profiling and which requests get profiled."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.profiles_dir = os.path.join(self.tmp.name, 'profiles')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def profiles(self):
+        return sorted(os.listdir(self.profiles_dir)) if os.path.isdir(self.profiles_dir) else []
+
+    def test_disabled_registers_nothing(self):
+        """Test that without PROFILING_ENABLED no hooks are installed."""
+        app = make_app(self.profiles_dir)
+        self.assertFalse(init_profiling(app))
+        self.assertEqual(app.before_request_funcs, {})
+        app.test_client().get('/work', headers={PROFILE_HEADER: make_profile_token('test-secret')})
+        self.assertEqual(self.profiles(), [])
+
+    def test_signed_header_profiles_request(self):
+        """Test that a valid token writes a profile with its summary, and a forged one does not."""
+        app = make_app(self.profiles_dir, PROFILING_ENABLED=True)
+        self.assertTrue(init_profiling(app))
+        client = app.test_client()
+
+        client.get('/work', headers={PROFILE_HEADER: make_profile_token('wrong-secret')})
+        self.assertEqual(self.profiles(), [])
+
+        response = client.get('/work', headers={PROFILE_HEADER: make_profile_token('test-secret')})
+        self.assertEqual(response.data, b'done')
+        [profile] = self.profiles()
+        files = set(os.listdir(os.path.join(self.profiles_dir, profile)))
+        self.assertEqual(files, {'profile.html', 'profile.speedscope.json', 'profile.folded', 'summary.json'})
+
+        with open(os.path.join(self.profiles_dir, profile, 'summary.json')) as f:
+            summary = json.load(f)
+        self.assertEqual((summary['path'], summary['status'], summary['trigger']), ('/work', 200, 'header'))
+        self.assertEqual(summary['sql']['count'], 1)
+        self.assertEqual(summary['templates']['count'], 1)
+
+    def test_sampling_keeps_newest_profiles(self):
+        """Test that sampled requests are profiled and old profiles are pruned."""
+        app = make_app(self.profiles_dir, PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0,
+                       PROFILING_MAX_PROFILES=2)
+        init_profiling(app)
+        client = app.test_client()
+        for _ in range(4):
+            client.get('/work')
+        self.assertEqual(len(self.profiles()), 2)
+
+
+class TestSummarizeTimings(unittest.TestCase):
+    """Test splitting request time into SQL, templates and other work."""
+
+    def test_queries_inside_templates_count_as_sql(self):
+        """Test that lazy loads during rendering are not counted twice."""
+        engine = create_engine('sqlite://')
+        profile = {
+            'queries': [
+                {'statement': 'SELECT 1', 'parameters': None, 'duration_ms': 10.0, 'engine': engine,
+                 'in_template': False},
+                {'statement': 'SELECT 2', 'parameters': None, 'duration_ms': 60.0, 'engine': engine,
+                 'in_template': True},
+            ],
+            'templates': [{'name': 'index.html', 'duration_ms': 80.0}],
+        }
+        summary = summarize_timings(profile, duration_ms=100.0, threshold_ms=50.0)
+
+        self.assertEqual(summary['sql']['total_ms'], 70.0)
+        self.assertEqual(summary['templates']['total_ms'], 20.0)
+        self.assertEqual(summary['other_ms'], 10.0)
+        # Only the slow query is listed; EXPLAIN is Postgres only
+        self.assertEqual(summary['sql']['slow'], [{'statement': 'SELECT 2', 'duration_ms': 60.0, 'plan': None}])
+
+
+class TestPruneProfiles(unittest.TestCase):
+    """Test profile retention."""
+
+    def test_removes_old_and_excess_profiles(self):
+        """Test that profiles past the age limit or count limit are deleted, oldest first."""
+        with tempfile.TemporaryDirectory() as profiles_dir:
+            now = time.time()
+            for name, age_hours in [('a', 100), ('b', 3), ('c', 2), ('d', 1)]:
+                path = os.path.join(profiles_dir, name)
+                os.mkdir(path)
+                os.utime(path, (now - age_hours * 3600,) * 2)
+
+            self.assertEqual(prune_profiles(profiles_dir, max_profiles=2, max_age_hours=72), 2)
+            self.assertEqual(sorted(os.listdir(profiles_dir)), ['c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
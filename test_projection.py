@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Tests for the level-up projection simulation."""
+
+import unittest
+import numpy as np
+from projection import MIN_ROUNDS, hole_distributions, simulate_totals, project
+
+
+def exact_totals(probabilities):
+    """Exact distribution of round totals, by convolving the holes."""
+    totals = np.array([1.0])
+    for hole in probabilities:
+        totals = np.convolve(totals, np.concatenate([[0.0], hole]))
+    return totals  # totals[s] is the chance of a round of s strokes
+
+
+class TestHoleDistributions(unittest.TestCase):
+    """Test building per-hole stroke probabilities."""
+
+    def test_rows_are_probabilities(self):
+        """Test that each hole's probabilities sum to one."""
+        probabilities = hole_distributions([[4, 5, 3, 6, 4, 5, 4, 7, 4]] * 5)
+        self.assertEqual(probabilities.shape, (9, 10))
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0)
+        self.assertTrue((probabilities > 0).any(axis=1).all())
+
+    def test_recent_rounds_weigh_more(self):
+        """Test that the newest round moves a hole's distribution the most."""
+        probabilities = hole_distributions([[3] * 9] + [[6] * 9] * 4)
+        older_first = hole_distributions([[6] * 9] * 4 + [[3] * 9])
+        self.assertGreater(probabilities[0, 2], older_first[0, 2])
+
+
+class TestProject(unittest.TestCase):
+    """Test the projection returned to the progress dashboard."""
+
+    def test_needs_minimum_rounds(self):
+        """Test that too little history gives no projection."""
+        self.assertIsNone(project([[4] * 9] * (MIN_ROUNDS - 1)))
+
+    def test_consistent_player_near_target(self):
+        """Test a player who always shoots 36 is very likely to again."""
+        projection = project([[4] * 9] * 10, seed=1)
+        self.assertGreater(projection['par_or_better_chance'], 0.4)
+        self.assertLess(projection['expected_rounds'], 2.5)
+        self.assertEqual(projection['rounds_used'], 10)
+
+    def test_far_from_target(self):
+        """Test that a player far above 36 gets no expected round count."""
+        projection = project([[7] * 9] * 10, seed=1)
+        self.assertEqual(projection['par_or_better_chance'], 0)
+        self.assertIsNone(projection['expected_rounds'])
+        self.assertIsNone(projection['rounds_for_90_percent'])
+
+    def test_same_seed_same_projection(self):
+        """Test that a seed makes the projection reproducible across workers."""
+        rounds = [[4, 5, 3, 6, 4, 5, 4, 7, 4], [5, 4, 4, 5, 3, 6, 4, 5, 5], [4, 4, 4, 5, 4, 4, 5, 6, 4]]
+        self.assertEqual(project(rounds, seed=(7, 12)), project(rounds, seed=(7, 12)))
+
+
+class TestSimulateTotals(unittest.TestCase):
+    """Test the simulation against the exact distribution."""
+
+    def test_matches_exact_convolution(self):
+        """Test that simulated totals agree with convolving the holes."""
+        rounds = [[4, 5, 3, 6, 4, 5, 4, 7, 4], [5, 4, 4, 5, 3, 6, 4, 5, 5], [3, 4, 4, 5, 4, 4, 5, 6, 4]]
+        probabilities = hole_distributions(rounds)
+        exact = exact_totals(probabilities)
+
+        totals = simulate_totals(probabilities, n=100_000, rng=np.random.default_rng(3))
+        self.assertAlmostEqual(totals.mean(), (exact * np.arange(len(exact))).sum(), delta=0.05)
+        self.assertAlmostEqual(np.mean(totals <= 36), exact[:37].sum(), delta=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
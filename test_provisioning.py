@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Tests for bulk account provisioning and, given scratch Postgres databases,
+account creation, provisioning jobs and the /admin/provision routes.
+
+The Postgres tests run only when TEST_DATABASE_URL (and, for the sharded
+ones, TEST_SHARD_URLS) is set. They drop and recreate the public schema of
+those databases, so never point them at real data.
+"""
+
+import io
+import json
+import os
+import unittest
+from unittest import mock
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import check_password_hash
+import app as golf_app
+import init_db
+from db_models import db, UserDirectory, ProvisionJob, shard_engine
+from migrations import run_migrations, ROLE_MAIN
+from provisioning import (read_students_csv, hash_credentials, insert_accounts, provision_students,
+                          start_provision_job, run_provision_job, active_provision_job, INVITE_HASH_METHOD)
+from sharding import shard_keys, place_new_user, register_user, interleave_id_sequences
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+TEST_SHARD_URLS = os.environ.get('TEST_SHARD_URLS')
+
+
+class TestReadStudentsCsv(unittest.TestCase):
+    """Test CSV parsing and row validation."""
+    
+    def test_parses_emails_and_passwords(self):
+        """Test that emails are normalized and passwords kept."""
+        csv_data = io.StringIO("Email,Password\n Alice@Example.com ,secret123\nbob@example.com,\n")
+        students, errors = read_students_csv(csv_data)
+        
+        self.assertEqual(students, [('alice@example.com', 'secret123'), ('bob@example.com', '')])
+        self.assertEqual(errors, [])
+    
+    def test_accepts_bytes_with_bom(self):
+        """Test that uploaded bytes with a UTF-8 BOM are decoded."""
+        students, errors = read_students_csv('\ufeffemail\ncarol@example.com\n'.encode('utf-8'))
+        self.assertEqual(students, [('carol@example.com', '')])
+        self.assertEqual(errors, [])
+    
+    def test_skips_invalid_rows(self):
+        """Test that bad emails, duplicates and short passwords are reported."""
+        csv_data = io.StringIO(
+            "email,password\n"
+            "not-an-email,secret123\n"
+            "dave@example.com,secret123\n"
+            "DAVE@example.com,secret456\n"
+            "erin@example.com,short\n"
+        )
+        students, errors = read_students_csv(csv_data)
+        
+        self.assertEqual(students, [('dave@example.com', 'secret123')])
+        self.assertEqual(len(errors), 3)
+        self.assertIn('Line 2', errors[0])
+        self.assertIn('duplicate', errors[1])
+        self.assertIn('shorter', errors[2])
+    
+    def test_extra_fields(self):
+        """Test that a trailing comma is ignored and real extra fields are reported."""
+        csv_data = io.StringIO(
+            "email,password\n"
+            "alice@example.com,secret123,\n"
+            "bob@example.com,secret123,unexpected\n"
+        )
+        students, errors = read_students_csv(csv_data)
+        
+        self.assertEqual(students, [('alice@example.com', 'secret123')])
+        self.assertEqual(errors, ['Line 3: more fields than the header'])
+    
+    def test_missing_fields(self):
+        """Test that a row shorter than the header gets a blank password."""
+        students, errors = read_students_csv(io.StringIO("email,password\ncarol@example.com\n"))
+        self.assertEqual(students, [('carol@example.com', '')])
+        self.assertEqual(errors, [])
+    
+    def test_reports_lines_that_are_not_utf8(self):
+        """Test that a Latin-1 line is reported and the rest of the file is read."""
+        data = "email,name\ndave@example.com,Dave\nerin@example.com,Ren\xe9e\nfrank@example.com,Frank\n"
+        students, errors = read_students_csv(data.encode('latin-1'))
+        
+        self.assertEqual([email for email, _ in students], ['dave@example.com', 'frank@example.com'])
+        self.assertEqual(errors, ['Line 3: not UTF-8 text'])
+    
+    def test_header_that_is_not_utf8(self):
+        """Test that an undecodable header is reported instead of raising."""
+        students, errors = read_students_csv('\xe9mail\nalice@example.com\n'.encode('latin-1'))
+        self.assertEqual(students, [])
+        self.assertEqual(errors, ['Line 1: not UTF-8 text', 'CSV must have an "email" column'])
+    
+    def test_requires_email_column(self):
+        """Test that a CSV without an email column is rejected."""
+        students, errors = read_students_csv(io.StringIO("name\nFrank\n"))
+        self.assertEqual(students, [])
+        self.assertEqual(errors, ['CSV must have an "email" column'])
+
+
+class TestHashCredentials(unittest.TestCase):
+    """Test password and invite token hashing."""
+    
+    def test_hashes_passwords_and_generates_invites(self):
+        """Test that blank passwords get an invite token that matches its hash."""
+        students = [('alice@example.com', 'secret123'), ('bob@example.com', '')]
+        hashed, invites = hash_credentials(students, workers=2)
+        
+        self.assertEqual([email for email, _ in hashed], ['alice@example.com', 'bob@example.com'])
+        self.assertTrue(check_password_hash(hashed[0][1], 'secret123'))
+        self.assertEqual(list(invites), ['bob@example.com'])
+        self.assertTrue(check_password_hash(hashed[1][1], invites['bob@example.com']))
+    
+    def test_invite_tokens_use_the_cheap_hash(self):
+        """Test that invite-only students skip the slow password hash and the process pool."""
+        with mock.patch('provisioning.ProcessPoolExecutor') as pool:
+            hashed, invites = hash_credentials([('carol@example.com', ''), ('dave@example.com', '')])
+        
+        pool.assert_not_called()
+        self.assertTrue(hashed[0][1].startswith(INVITE_HASH_METHOD + '$'))
+        self.assertTrue(check_password_hash(hashed[1][1], invites['dave@example.com']))
+
+
+def _create_app(app_factory, **env):
+    environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+    environ.update(env)
+    with mock.patch.dict(os.environ, environ, clear=True):
+        return app_factory()
+
+
+def _reset_schemas():
+    for shard in shard_keys():
+        with shard_engine(shard).begin() as conn:
+            conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+            conn.exec_driver_sql('CREATE SCHEMA public')
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and TEST_SHARD_URLS,
+                     'set TEST_DATABASE_URL and TEST_SHARD_URLS to scratch Postgres databases')
+class TestInsertAccounts(unittest.TestCase):
+    """Test creating accounts across real shards."""
+    
+    def setUp(self):
+        self.app = _create_app(init_db.create_app, DATABASE_URL=TEST_DATABASE_URL, SHARD_URLS=TEST_SHARD_URLS)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        _reset_schemas()
+        for _, engine, role in init_db.shard_databases():
+            run_migrations(engine, role)
+        interleave_id_sequences()
+    
+    def tearDown(self):
+        db.session.remove()
+        _reset_schemas()
+        # See TestShardedAccounts in test_sharding.py
+        for shard in shard_keys()[1:]:
+            db.metadatas.pop(shard, None)
+        self.ctx.pop()
+    
+    def directory(self):
+        entries = dict(db.session.execute(select(UserDirectory.email, UserDirectory.shard)).all())
+        db.session.rollback()
+        return entries
+    
+    def shard_emails(self, shard):
+        with shard_engine(shard).connect() as conn:
+            return set(conn.execute(text(
+                'SELECT u.email FROM users u JOIN user_profiles p ON p.user_id = u.id'
+            )).scalars())
+    
+    def test_creates_accounts_on_their_shards_and_skips_existing(self):
+        """Test that each account lands on its shard with a profile, and taken emails are skipped."""
+        register_user('taken@example.com', 'secret')
+        emails = [f'student{n}@example.com' for n in range(12)]
+        hashed = [(email, 'hash') for email in emails + ['taken@example.com']]
+        
+        created = insert_accounts(hashed, batch_size=5)
+        
+        self.assertEqual(sorted(created), sorted(emails))
+        directory = self.directory()
+        for shard in shard_keys():
+            on_shard = {email for email in emails if directory[email] == shard}
+            self.assertEqual(self.shard_emails(shard) - {'taken@example.com'}, on_shard)
+        self.assertEqual(len({directory[email] for email in emails}), len(shard_keys()))
+    
+    def test_shard_failure_releases_its_emails(self):
+        """Test that emails a shard rejected leave the directory and can be provisioned again."""
+        emails = [f'student{n}@example.com' for n in range(12)]
+        failing = place_new_user(emails[0])
+        with shard_engine(failing).begin() as conn:
+            conn.execute(text("INSERT INTO users (id, email, password_hash) VALUES (999999, :email, 'x')"),
+                         {'email': emails[0]})
+        
+        with self.assertRaises(IntegrityError):
+            insert_accounts([(email, 'hash') for email in emails])
+        directory = self.directory()
+        self.assertFalse([email for email in emails if place_new_user(email) == failing and email in directory])
+        
+        with shard_engine(failing).begin() as conn:
+            conn.execute(text('DELETE FROM users WHERE id = 999999'))
+        insert_accounts([(email, 'hash') for email in emails])
+        self.assertEqual(set(self.directory()), set(emails))
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'set TEST_DATABASE_URL to a scratch Postgres database')
+class TestProvisionJobs(unittest.TestCase):
+    """Test provisioning reports, job status and the /admin/provision routes."""
+    
+    def setUp(self):
+        self.app = _create_app(golf_app.create_app, DATABASE_URL=TEST_DATABASE_URL)
+        self.app.config['ADMIN_EMAILS'] = {'admin@example.com'}
+        # Requests get their own app context, so Flask-Login does not reuse a user from g
+        with self.app.app_context():
+            _reset_schemas()
+            run_migrations(db.engine, ROLE_MAIN)
+            self.admin_id = register_user('admin@example.com', 'secret').id
+            self.coach_id = register_user('coach@example.com', 'secret').id
+    
+    def tearDown(self):
+        with self.app.app_context():
+            _reset_schemas()
+    
+    def client_for(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    
+    def upload(self, client, csv_text):
+        return client.post('/admin/provision', data={'file': (io.BytesIO(csv_text.encode('utf-8')), 'students.csv')},
+                           content_type='multipart/form-data')
+    
+    def test_report_counts_created_and_skipped(self):
+        """Test the throughput report and that invites are only returned for new accounts."""
+        students = [('new1@example.com', ''), ('new2@example.com', 'secret123'), ('coach@example.com', '')]
+        with self.app.app_context():
+            report = provision_students(students, workers=1)
+        
+        self.assertEqual((report['rows'], report['created'], report['skipped']), (3, 2, 1))
+        self.assertEqual(list(report['invites']), ['new1@example.com'])
+        self.assertGreater(report['rows_per_second'], 0)
+        self.assertAlmostEqual(report['elapsed_seconds'], report['hash_seconds'] + report['insert_seconds'],
+                               delta=0.01)
+    
+    def test_job_status_transitions(self):
+        """Test queued -> done with a report, queued -> failed with the error, and no second run."""
+        with self.app.app_context():
+            with mock.patch('provisioning.subprocess.Popen'):
+                job = start_provision_job([('new1@example.com', '')])
+            self.assertEqual(job.status, 'queued')
+            self.assertEqual(active_provision_job().id, job.id)
+            
+            report = run_provision_job(job.id, {'students': [['new1@example.com', '']], 'batch_size': 10})
+            job = db.session.get(ProvisionJob, job.id)
+            self.assertEqual((job.status, job.report['created']), ('done', 1))
+            self.assertEqual(report['created'], 1)
+            self.assertIsNone(active_provision_job())
+            with self.assertRaises(ValueError):
+                run_provision_job(job.id, {'students': [], 'batch_size': 10})
+            
+            with mock.patch('provisioning.subprocess.Popen'):
+                failing = start_provision_job([('new2@example.com', '')])
+            with mock.patch('provisioning.provision_students', side_effect=RuntimeError('disk full')):
+                with self.assertRaises(RuntimeError):
+                    run_provision_job(failing.id, {'students': [['new2@example.com', '']], 'batch_size': 10})
+            failing = db.session.get(ProvisionJob, failing.id)
+            self.assertEqual((failing.status, failing.error), ('failed', 'RuntimeError: disk full'))
+    
+    def test_admin_provision_routes(self):
+        """Test 403 for non-admins, 202 then 409 while a job runs, and invites handed out once."""
+        csv_text = 'email,password\nnew1@example.com,\nnew2@example.com,\n'
+        self.assertEqual(self.upload(self.client_for(self.coach_id), csv_text).status_code, 403)
+        
+        admin = self.client_for(self.admin_id)
+        with mock.patch('provisioning.subprocess.Popen') as popen:
+            response = self.upload(admin, csv_text)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.get_json()['status'], 'queued')
+            status_url = response.get_json()['status_url']
+            
+            busy = self.upload(admin, csv_text)
+            self.assertEqual(busy.status_code, 409)
+            self.assertEqual(busy.get_json()['status_url'], status_url)
+        self.assertEqual(popen.call_count, 1)
+        
+        # Run the job the way the spawned init_db.py process would, with what it was sent
+        payload = json.loads(popen.return_value.stdin.write.call_args[0][0])
+        with self.app.app_context():
+            run_provision_job(response.get_json()['job_id'], payload)
+        
+        first = admin.get(status_url).get_json()
+        self.assertEqual(first['status'], 'done')
+        self.assertEqual(sorted(first['report']['invites']), ['new1@example.com', 'new2@example.com'])
+        second = admin.get(status_url).get_json()
+        self.assertEqual(second['report']['invites'], {})
+        self.assertTrue(second['report']['invites_collected'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Tests for the circuit breaker, snapshot store and score spool."""
+
+import os
+import queue
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+import app as app_module
+import resilience
+from app import create_app
+from db_models import db, User, UserProfile, Round
+from resilience import (CircuitBreaker, SnapshotStore, ScoreSpool, DatabaseUnavailable, get_spool, replay_spool,
+                        schedule_revalidation)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test opening, failing fast and recovering."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_seconds=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that the breaker opens only after the threshold is reached."""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.seconds_until_retry(), 10)
+
+    def test_success_resets_failure_count(self):
+        """Test that failures must be consecutive to open the breaker."""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_trial(self):
+        """Test that a failed trial reopens and a successful one closes."""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 10
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.clock.now += 10
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_allows_one_trial(self):
+        """Test that only one call passes while the trial is out, until it times out."""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+
+class TestSnapshotStore(unittest.TestCase):
+    """Test per-user snapshot storage."""
+
+    def test_drops_least_recently_used_users(self):
+        """Test that reading a snapshot keeps its user from being evicted."""
+        store = SnapshotStore(max_users=2)
+        store.save(1, 'stats', {'stats': 'one'})
+        store.save(2, 'stats', {'stats': 'two'})
+        store.get(1, 'stats')
+        store.save(3, 'stats', {'stats': 'three'})
+
+        self.assertEqual(store.get(1, 'stats').context, {'stats': 'one'})
+        self.assertIsNone(store.get(2, 'stats'))
+        self.assertIsNone(store.get(3, 'history'))
+
+
+class TestScoreSpool(unittest.TestCase):
+    """Test the durable score spool."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spool = ScoreSpool(os.path.join(self.tmp.name, 'spool', 'scores.sqlite3'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_empty_spool_without_file(self):
+        """Test that counting does not create the spool file."""
+        self.assertEqual(self.spool.pending_count(), 0)
+        self.assertFalse(os.path.exists(self.spool.path))
+
+    def test_entries_come_back_in_order(self):
+        """Test that rounds are returned oldest first with their data intact."""
+        submitted_at = datetime(2024, 5, 1, 9, 30, 15, 123456)
+        self.spool.append(7, [4] * 9, submitted_at)
+        self.spool.append(8, [5] * 9)
+        self.spool.append(7, [3] * 9)
+
+        entries = self.spool.pending()
+        self.assertEqual([(e.user_id, e.holes[0]) for e in entries], [(7, 4), (8, 5), (7, 3)])
+        self.assertEqual(entries[0].submitted_at, submitted_at)
+        self.assertEqual(self.spool.pending_count(7), 2)
+
+    def test_remove_and_mark_failed(self):
+        """Test that handled rounds leave the queue."""
+        first = self.spool.append(1, [4] * 9)
+        second = self.spool.append(1, [5] * 9)
+        self.spool.remove(first)
+        self.spool.mark_failed(second, 'LookupError')
+
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(self.spool.failed_count(), 1)
+
+
+class TestScheduleRevalidation(unittest.TestCase):
+    """Test queueing snapshot refreshes for the background worker."""
+
+    def test_queue_is_bounded_and_deduplicated(self):
+        """Test that a queued section is not queued twice and a full queue refuses more."""
+        worker = mock.Mock(is_alive=mock.Mock(return_value=True))
+        with mock.patch.object(resilience, '_revalidation_queue', queue.Queue(maxsize=1)), \
+                mock.patch.object(resilience, '_revalidation_worker', worker), \
+                mock.patch.object(resilience, '_revalidating', set()):
+            self.assertTrue(schedule_revalidation(None, 1, 'stats', None))
+            self.assertFalse(schedule_revalidation(None, 1, 'stats', None))
+            self.assertFalse(schedule_revalidation(None, 2, 'stats', None))
+            self.assertEqual(resilience._revalidating, {(1, 'stats')})
+
+
+class TestSpooledSubmission(unittest.TestCase):
+    """Test submitting a score during an outage and replaying it on SQLite."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.app = create_app({
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmp.name, 'golf.sqlite3'),
+                'SPOOL_PATH': os.path.join(self.tmp.name, 'spool', 'scores.sqlite3'),
+            })
+        with self.app.app_context():
+            db.create_all()
+            user = User(id=1, email='golfer@example.com')
+            user.set_password('secret')
+            user.profile = UserProfile()
+            db.session.add(user)
+            db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = '1'
+            session['_fresh'] = True
+        # Replay only when the test asks for it, not after every request
+        self.replay_interval = mock.patch.object(resilience, 'SPOOL_REPLAY_INTERVAL', float('inf'))
+        self.replay_interval.start()
+
+    def tearDown(self):
+        self.replay_interval.stop()
+        with self.app.app_context():
+            db.drop_all()
+            db.engine.dispose()
+        self.tmp.cleanup()
+
+    def submit(self, holes):
+        return self.client.post('/score', data={f'hole{n}': str(score) for n, score in enumerate(holes, 1)})
+
+    def rounds(self):
+        with self.app.app_context():
+            return [(r.total, r.played_at) for r in Round.query.order_by(Round.id)]
+
+    def test_outage_spools_and_replays_round(self):
+        """Test that a round refused by the database is recorded once on replay."""
+        def unavailable(func, *args, **kwargs):
+            raise DatabaseUnavailable('down')
+
+        with mock.patch('app.call_database', unavailable):
+            self.assertEqual(self.submit([4] * 9).status_code, 202)
+        [entry] = get_spool(self.app).pending()
+        self.assertEqual(self.rounds(), [])
+
+        self.assertEqual(replay_spool(self.app), (1, 0))
+        self.assertEqual(self.rounds(), [(36, entry.submitted_at)])
+        self.assertEqual(get_spool(self.app).pending_count(), 0)
+
+    def test_round_committed_before_error_is_not_replayed_twice(self):
+        """Test that a round whose commit landed before the error is recognised on replay."""
+        def lost_reply(func, *args, **kwargs):
+            func(*args, **kwargs)
+            raise DatabaseUnavailable('connection lost after commit')
+
+        with mock.patch('app.call_database', lost_reply):
+            self.assertEqual(self.submit([4] * 9).status_code, 202)
+        [entry] = get_spool(self.app).pending()
+        self.assertEqual(self.rounds(), [(36, entry.submitted_at)])
+
+        self.assertEqual(replay_spool(self.app), (1, 0))
+        self.assertEqual(self.rounds(), [(36, entry.submitted_at)])
+        with self.app.app_context():
+            self.assertEqual(UserProfile.query.filter_by(user_id=1).one().total_rounds, 1)
+
+    def test_projection_failure_does_not_spool_round(self):
+        """Test that a round is answered normally when only the projection refresh fails."""
+        with mock.patch('projection.refresh_projection', side_effect=RuntimeError('numpy blew up')):
+            response = self.submit([4] * 9)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.rounds()), 1)
+        self.assertEqual(get_spool(self.app).pending_count(), 0)
+        self.assertEqual(resilience.db_breaker.failures, 0)
+
+    def test_connection_lost_after_commit_answers_normally(self):
+        """Test that nothing after the commit reloads the profile, so the round is not retried."""
+        record = app_module.call_database
+
+        def drop_after_commit(func, *args, **kwargs):
+            result = record(func, *args, **kwargs)
+            lost.start()
+            return result
+
+        lost = mock.patch.object(Engine, 'connect', side_effect=OperationalError('SELECT', {}, 'connection lost'))
+        try:
+            with mock.patch('app.call_database', drop_after_commit):
+                response = self.submit([4] * 9)
+        finally:
+            lost.stop()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'leveled up to Level 2', response.data)
+        self.assertEqual(len(self.rounds()), 1)
+        self.assertEqual(get_spool(self.app).pending_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Tests for group dashboard rollups and their cache invalidation."""
+
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from flask import Flask
+import rollups
+from db_models import db, User, UserProfile, Round, UserDirectory, Group, GroupMember
+from rollups import build_group_rollup, get_group_rollup, _rollup_cache
+
+
+class TestGroupRollups(unittest.TestCase):
+    """Test aggregating a group's students on SQLite."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        _rollup_cache.clear()
+
+        now = datetime.utcnow()
+        self.group = Group(name='Tuesday Juniors')
+        db.session.add(self.group)
+        # coach, two students (alice levelled up twice, once at the max level) and an outsider
+        for user_id, email, level in [(1, 'coach@example.com', 1), (2, 'alice@example.com', 6),
+                                      (3, 'bob@example.com', 1), (4, 'outsider@example.com', 2)]:
+            db.session.add(UserDirectory(user_id=user_id, email=email))
+            db.session.add(User(id=user_id, email=email, password_hash='x'))
+            db.session.add(UserProfile(user_id=user_id, current_level=level))
+        db.session.flush()
+        db.session.add_all([
+            GroupMember(group_id=self.group.id, user_id=1, role='coach'),
+            GroupMember(group_id=self.group.id, user_id=2, role='student'),
+            GroupMember(group_id=self.group.id, user_id=3, role='student'),
+        ])
+        db.session.add_all([
+            Round(user_id=2, level=5, holes=[4] * 9, total=36, leveled_up=True, played_at=now - timedelta(days=2)),
+            Round(user_id=2, level=6, holes=[3] * 9, total=27, leveled_up=True, played_at=now - timedelta(days=1)),
+            Round(user_id=3, level=1, holes=[6] * 9, total=54, leveled_up=False, played_at=now - timedelta(days=30)),
+            Round(user_id=4, level=2, holes=[3] * 9, total=27, leveled_up=True, played_at=now),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_aggregates_students_only(self):
+        """Test totals, levels, level-ups and inactivity for the group's students."""
+        rollup = build_group_rollup(self.group.id)
+
+        self.assertEqual(rollup['student_count'], 2)
+        self.assertEqual([s['email'] for s in rollup['students']], ['alice@example.com', 'bob@example.com'])
+        self.assertEqual(rollup['level_distribution'], {1: 1, 2: 0, 3: 0, 4: 0, 5: 0, 6: 1})
+        self.assertEqual(rollup['total_rounds'], 3)
+        self.assertAlmostEqual(rollup['average_score'], (36 + 27 + 54) / 3)
+        self.assertEqual(rollup['best_score'], 27)
+        # A par round at the max level is not a level-up
+        self.assertEqual([(l['from_level'], l['to_level']) for l in rollup['recent_level_ups']], [(5, 6)])
+        self.assertEqual([s['email'] for s in rollup['inactive_students']], ['bob@example.com'])
+
+    def test_member_round_invalidates_cache(self):
+        """Test that a member's round rebuilds the rollup without touching the groups row."""
+        first = get_group_rollup(self.group)
+        self.assertIs(get_group_rollup(self.group), first)
+
+        bob = UserProfile.query.filter_by(user_id=3).first()
+        bob.add_round([4] * 9)
+
+        rollup = get_group_rollup(self.group)
+        self.assertIsNot(rollup, first)
+        self.assertEqual(rollup['total_rounds'], 4)
+        self.assertEqual(db.session.get(Group, self.group.id).data_version, 0)
+
+    def test_outsider_round_keeps_cache(self):
+        """Test that rounds by users outside the group do not invalidate it."""
+        first = get_group_rollup(self.group)
+        UserProfile.query.filter_by(user_id=4).first().add_round([5] * 9)
+        self.assertIs(get_group_rollup(self.group), first)
+
+    def test_membership_change_invalidates_cache(self):
+        """Test that adding a student changes the group's version."""
+        before = self.group.current_version()
+        db.session.add(GroupMember(group_id=self.group.id, user_id=4, role='student'))
+        db.session.commit()
+        self.assertNotEqual(self.group.current_version(), before)
+        self.assertEqual(get_group_rollup(self.group)['student_count'], 3)
+
+    def test_cache_drops_least_recently_used_groups(self):
+        """Test that the cache keeps at most ROLLUP_CACHE_MAX_GROUPS rollups."""
+        other = Group(name='Saturday Seniors')
+        db.session.add(other)
+        db.session.commit()
+        with mock.patch.object(rollups, 'ROLLUP_CACHE_MAX_GROUPS', 1):
+            get_group_rollup(self.group)
+            get_group_rollup(other)
+        self.assertEqual(list(_rollup_cache), [other.id])
+
+
+if __name__ == '__main__':
+    unittest.main()
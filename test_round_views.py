@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Tests for the Core round read path."""
+
+import unittest
+from datetime import datetime
+from flask import Flask
+from db_models import db, User, Round
+from round_views import RoundView, decode_holes, recent_rounds, holes_at_level
+
+
+class TestRoundViews(unittest.TestCase):
+    """Test reading rounds without loading Round objects."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        db.session.add(User(id=1, email='player@example.com', password_hash='x'))
+        db.session.add_all([
+            Round(user_id=1, level=1, holes=[5] * 9, total=45, leveled_up=False,
+                  played_at=datetime(2024, 5, 1, 9)),
+            # Early rounds stored holes as a JSON-encoded string
+            Round(user_id=1, level=1, holes='[4, 4, 4, 4, 4, 4, 4, 4, 4]', total=36, leveled_up=True,
+                  played_at=datetime(2024, 5, 2, 9)),
+            Round(user_id=1, level=2, holes=[6] * 9, total=54, leveled_up=False,
+                  played_at=datetime(2024, 5, 3, 9)),
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_recent_rounds_newest_first(self):
+        """Test that rounds come back as RoundViews with decoded holes."""
+        views = recent_rounds(1, limit=2)
+        self.assertEqual(views, [
+            RoundView(2, 54, False, datetime(2024, 5, 3, 9), [6] * 9),
+            RoundView(1, 36, True, datetime(2024, 5, 2, 9), [4] * 9),
+        ])
+        self.assertNotIn(Round, {type(obj) for obj in db.session.identity_map.values()})
+
+    def test_holes_at_level(self):
+        """Test that only the requested level's holes are returned."""
+        self.assertEqual(holes_at_level(1, 1, limit=10), [[4] * 9, [5] * 9])
+        self.assertEqual(holes_at_level(2, 1, limit=10), [])
+
+    def test_decode_holes(self):
+        """Test that lists pass through and JSON strings are decoded."""
+        self.assertEqual(decode_holes([3, 4]), [3, 4])
+        self.assertEqual(decode_holes('[3, 4]'), [3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
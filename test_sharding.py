@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Tests for shard configuration, placement of new users and, given scratch
+Postgres databases, registering and moving users.
+
+The Postgres tests run only when TEST_DATABASE_URL (and, for the sharded
+ones, TEST_SHARD_URLS) is set. They drop and recreate the public schema of those databases, so never
+point them at real data.
+"""
+
+import os
+import unittest
+from unittest import mock
+from flask import Flask
+from sqlalchemy import select, func, text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+import app as golf_app
+from db_models import db, Round, UserDirectory, ShardNotSelected, shard_engine
+from init_db import create_app, shard_databases
+from migrations import run_migrations, ROLE_MAIN
+from round_views import recent_rounds
+from sharding import (configure_shards, place_new_user, shard_keys, is_sharded, register_user, move_user,
+                      rebalance, shard_user_counts, interleave_id_sequences, sync_directory)
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+TEST_SHARD_URLS = os.environ.get('TEST_SHARD_URLS')
+
+
+class TestConfigureShards(unittest.TestCase):
+    """Test reading SHARD_URLS and SHARD_NEW_USERS."""
+
+    def configure(self, **env):
+        app = Flask(__name__)
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+        environ.update(env)
+        with mock.patch.dict(os.environ, environ, clear=True):
+            configure_shards(app)
+        return app
+
+    def test_single_database_without_shard_urls(self):
+        """Test that no binds are added when SHARD_URLS is unset."""
+        app = self.configure()
+        self.assertEqual(app.config['SHARD_KEYS'], ['default'])
+        self.assertEqual(app.config['SQLALCHEMY_BINDS'], {})
+        with app.app_context():
+            self.assertFalse(is_sharded())
+
+    def test_shard_urls_become_binds(self):
+        """Test that each URL becomes a shard_N bind using the psycopg driver."""
+        app = self.configure(SHARD_URLS='postgresql://db1/golf, postgresql://db2/golf')
+        self.assertEqual(app.config['SHARD_KEYS'], ['default', 'shard_1', 'shard_2'])
+        self.assertEqual(app.config['SQLALCHEMY_BINDS']['shard_2'], 'postgresql+psycopg://db2/golf')
+        self.assertEqual(app.config['SHARD_NEW_USERS'], ['default', 'shard_1', 'shard_2'])
+        with app.app_context():
+            self.assertTrue(is_sharded())
+            self.assertEqual(shard_keys()[0], 'default')
+
+    def test_rejects_unknown_new_user_shard(self):
+        """Test that SHARD_NEW_USERS may only name configured shards."""
+        with self.assertRaises(ValueError):
+            self.configure(SHARD_URLS='postgresql://db1/golf', SHARD_NEW_USERS='shard_3')
+
+
+class TestPlaceNewUser(unittest.TestCase):
+    """Test hashing new accounts onto shards."""
+
+    def test_placement_is_stable_and_limited_to_new_user_shards(self):
+        """Test that an email always maps to the same allowed shard."""
+        app = Flask(__name__)
+        app.config['SHARD_NEW_USERS'] = ['shard_1', 'shard_2']
+        with app.app_context():
+            placements = [place_new_user(f'student{i}@example.com') for i in range(50)]
+            self.assertEqual(placements, [place_new_user(f'student{i}@example.com') for i in range(50)])
+        self.assertEqual(set(placements), {'shard_1', 'shard_2'})
+
+
+class TestShardRouting(unittest.TestCase):
+    """Test that per-user queries need a shard once SHARD_URLS is set."""
+
+    def test_core_statements_are_routed(self):
+        """Test that a Core select on rounds is not sent to the main database."""
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SHARD_KEYS'] = ['default', 'shard_1']
+        db.init_app(app)
+        with app.app_context():
+            with self.assertRaises(ShardNotSelected):
+                recent_rounds(1)
+            db.session.remove()
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and TEST_SHARD_URLS,
+                     'set TEST_DATABASE_URL and TEST_SHARD_URLS to scratch Postgres databases')
+class TestShardedAccounts(unittest.TestCase):
+    """Test registering, moving and rebalancing users across real shards."""
+
+    def setUp(self):
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+        environ.update(DATABASE_URL=TEST_DATABASE_URL, SHARD_URLS=TEST_SHARD_URLS)
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.reset_schemas()
+        for _, engine, role in shard_databases():
+            run_migrations(engine, role)
+        interleave_id_sequences()
+
+    def tearDown(self):
+        db.session.remove()
+        self.reset_schemas()
+        # init_app added a MetaData per shard bind to the shared db; drop them so
+        # later SQLite tests' create_all does not look for those binds
+        for shard in shard_keys()[1:]:
+            db.metadatas.pop(shard, None)
+        self.ctx.pop()
+
+    def reset_schemas(self):
+        for shard in shard_keys():
+            with shard_engine(shard).begin() as conn:
+                conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+                conn.exec_driver_sql('CREATE SCHEMA public')
+
+    def rows_on(self, shard, table, user_column, user_id):
+        with shard_engine(shard).connect() as conn:
+            return conn.execute(
+                text(f'SELECT count(*) FROM {table} WHERE {user_column} = :user_id'), {'user_id': user_id}
+            ).scalar()
+
+    def directory_shard(self, user_id):
+        shard = db.session.execute(select(UserDirectory.shard).where(UserDirectory.user_id == user_id)).scalar()
+        db.session.rollback()
+        return shard
+
+    def test_register_user_places_user_on_its_shard(self):
+        """Test that the user and profile land on the hashed shard and a taken email is refused."""
+        email = 'alice@example.com'
+        user_id = register_user(email, 'secret').id
+        shard = place_new_user(email)
+
+        self.assertEqual(self.directory_shard(user_id), shard)
+        self.assertEqual(self.rows_on(shard, 'users', 'id', user_id), 1)
+        self.assertEqual(self.rows_on(shard, 'user_profiles', 'user_id', user_id), 1)
+        self.assertIsNone(register_user(email, 'other'))
+
+    def test_failed_shard_insert_releases_email(self):
+        """Test that a directory entry is removed when its shard rejects the user."""
+        email = 'bob@example.com'
+        shard = place_new_user(email)
+        with shard_engine(shard).begin() as conn:
+            conn.execute(text("INSERT INTO users (id, email, password_hash) VALUES (999999, :email, 'x')"),
+                         {'email': email})
+
+        with self.assertRaises(IntegrityError):
+            register_user(email, 'secret')
+        count = db.session.execute(
+            select(func.count()).select_from(UserDirectory).where(UserDirectory.email == email)
+        ).scalar()
+        db.session.rollback()
+        self.assertEqual(count, 0)
+
+        with shard_engine(shard).begin() as conn:
+            conn.execute(text('DELETE FROM users WHERE id = 999999'))
+        self.assertIsNotNone(register_user(email, 'secret'))
+
+    def test_move_user_copies_rows_and_switches_directory(self):
+        """Test that a move keeps round ids, empties the source and can be re-run."""
+        user = register_user('carol@example.com', 'secret')
+        user_id = user.id
+        source = place_new_user('carol@example.com')
+        target = next(shard for shard in shard_keys() if shard != source)
+        user.profile.add_round([4] * 9)
+        user.profile.add_round([5] * 9)
+        round_ids = sorted(db.session.execute(select(Round.id).where(Round.user_id == user_id)).scalars())
+        db.session.rollback()
+
+        self.assertTrue(move_user(user_id, target))
+        self.assertEqual(self.directory_shard(user_id), target)
+        for table, column in (('users', 'id'), ('user_profiles', 'user_id'), ('rounds', 'user_id')):
+            self.assertEqual(self.rows_on(source, table, column, user_id), 0)
+        with shard_engine(target).connect() as conn:
+            moved_ids = sorted(conn.execute(
+                select(Round.__table__.c.id).where(Round.__table__.c.user_id == user_id)
+            ).scalars())
+        self.assertEqual(moved_ids, round_ids)
+        self.assertFalse(move_user(user_id, target))
+
+    def test_rebalance_evens_out_shards(self):
+        """Test that users placed on one shard are spread until counts differ by at most one."""
+        self.app.config['SHARD_NEW_USERS'] = ['default']
+        for n in range(7):
+            register_user(f'student{n}@example.com', 'secret')
+
+        moves = rebalance()
+        counts = shard_user_counts()
+        self.assertEqual(len(moves), 7 - counts['default'])
+        self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+        for user_id, _, target in moves:
+            self.assertEqual(self.rows_on(target, 'users', 'id', user_id), 1)
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'set TEST_DATABASE_URL to a scratch Postgres database')
+class TestDirectorySync(unittest.TestCase):
+    """Test accounts the previous release created without directory entries."""
+
+    def setUp(self):
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_')}
+        environ['DATABASE_URL'] = TEST_DATABASE_URL
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.app = golf_app.create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.reset_schema()
+        run_migrations(db.engine, ROLE_MAIN)
+
+    def tearDown(self):
+        db.session.remove()
+        self.reset_schema()
+        self.ctx.pop()
+
+    def reset_schema(self):
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+            conn.exec_driver_sql('CREATE SCHEMA public')
+
+    def add_legacy_user(self, email):
+        """Insert an account the way the pre-directory release did."""
+        with db.engine.begin() as conn:
+            user_id = conn.execute(
+                text("INSERT INTO users (email, password_hash) VALUES (:email, :hash) RETURNING id"),
+                {'email': email, 'hash': generate_password_hash('secret')}
+            ).scalar()
+            conn.execute(text(
+                'INSERT INTO user_profiles (user_id, current_level, total_rounds) VALUES (:user_id, 1, 0)'
+            ), {'user_id': user_id})
+        return user_id
+
+    def directory_ids(self):
+        ids = sorted(db.session.execute(select(UserDirectory.user_id)).scalars())
+        db.session.rollback()
+        return ids
+
+    def test_login_adds_missing_directory_entry(self):
+        """Test that an account created after the migration can log in and is then listed."""
+        user_id = self.add_legacy_user('late@example.com')
+        response = self.app.test_client().post('/login', data={'email': 'late@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.directory_ids(), [user_id])
+
+    def test_sync_adds_entries_and_advances_ids(self):
+        """Test that sync lists every account once and new ids do not collide with them."""
+        user_ids = [self.add_legacy_user(f'late{n}@example.com') for n in range(3)]
+        self.assertEqual(sync_directory(), 3)
+        self.assertEqual(sync_directory(), 0)
+        self.assertEqual(self.directory_ids(), user_ids)
+
+        self.assertGreater(register_user('new@example.com', 'secret').id, max(user_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
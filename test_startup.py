@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Tests for app startup: building the app, warmup and startup timings."""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from sqlalchemy.engine import Engine
+import app as golf_app
+from db_models import db
+
+# Nothing listens here, so connecting fails straight away
+UNREACHABLE_URL = 'postgresql://postgres@/golf?host=/nonexistent'
+
+
+def _create_app(**env):
+    environ = {k: v for k, v in os.environ.items() if not k.startswith('SHARD_') and k != 'APP_MASTER_PID'}
+    environ.update(env)
+    with mock.patch.dict(os.environ, environ, clear=True):
+        return golf_app.create_app()
+
+
+def _fake_proc(files):
+    def fake_open(path, *args, **kwargs):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[path])
+    return fake_open
+
+
+class TestCreateApp(unittest.TestCase):
+    """Test that building the app and serving /healthz never touch the database."""
+
+    def setUp(self):
+        self.connect = mock.patch.object(Engine, 'connect', side_effect=AssertionError('connected'))
+        self.connect.start()
+        self.app = _create_app(DATABASE_URL=UNREACHABLE_URL, SHARD_URLS=UNREACHABLE_URL)
+
+    def tearDown(self):
+        self.connect.stop()
+        db.metadatas.pop('shard_1', None)
+
+    def test_create_app_does_not_connect(self):
+        """Test that an unreachable database does not stop the app being built."""
+        self.assertEqual(self.app.config['SHARD_KEYS'], ['default', 'shard_1'])
+        self.assertEqual(set(self.app.config['STARTUP_TIMINGS']), {'imports_ms', 'create_app_ms'})
+
+    def test_healthz_reports_timings(self):
+        """Test that /healthz answers without the database and includes the first response time."""
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            response = self.app.test_client().get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body['status'], 'ok')
+        self.assertGreaterEqual(body['startup']['create_app_ms'], 0)
+        self.assertIn('Startup timings', output.getvalue())
+
+        second = self.app.test_client().get('/healthz').get_json()
+        self.assertGreater(second['startup']['first_response_s'], 0)
+
+
+class TestProcessStartedAt(unittest.TestCase):
+    """Test reading a process's start time from /proc."""
+
+    def test_parses_proc_stat(self):
+        """Test start ticks after a command name holding spaces and parentheses."""
+        files = {
+            '/proc/42/stat': '42 (gunicorn: master (app)) S ' + ' '.join(['0'] * 18) + ' 1500 0 0\n',
+            '/proc/stat': 'cpu  1 2 3\nbtime 1700000000\nprocesses 9\n',
+        }
+        with mock.patch('builtins.open', side_effect=_fake_proc(files)):
+            started = golf_app._process_started_at(42)
+        self.assertAlmostEqual(started, 1700000000 + 1500 / os.sysconf('SC_CLK_TCK'))
+
+    def test_falls_back_without_proc(self):
+        """Test that a missing /proc gives the time the app module was imported."""
+        with mock.patch('builtins.open', side_effect=_fake_proc({})):
+            started = golf_app._process_started_at()
+        expected = time.time() - (time.perf_counter() - golf_app._import_started)
+        self.assertAlmostEqual(started, expected, delta=1)
+
+    def test_falls_back_on_unexpected_format(self):
+        """Test that an unreadable stat line also falls back rather than raising."""
+        files = {'/proc/self/stat': 'garbage', '/proc/stat': 'btime 1700000000\n'}
+        with mock.patch('builtins.open', side_effect=_fake_proc(files)):
+            started = golf_app._process_started_at()
+        self.assertLessEqual(started, time.time())
+
+
+class TestWarmDatabase(unittest.TestCase):
+    """Test opening pool connections on every shard after fork."""
+
+    def tearDown(self):
+        for shard in ('shard_1', 'shard_2'):
+            db.metadatas.pop(shard, None)
+
+    def test_warms_every_shard(self):
+        """Test that each shard's pool holds the warmed connections afterwards."""
+        with tempfile.TemporaryDirectory() as tmp:
+            urls = [f"sqlite:///{os.path.join(tmp, name)}.db" for name in ('main', 'shard_1', 'shard_2')]
+            app = _create_app(DATABASE_URL=urls[0], SHARD_URLS=','.join(urls[1:]))
+            app.config['WARMUP_CONNECTIONS'] = 2
+            golf_app.warm_database(app)
+
+            with app.app_context():
+                self.assertEqual(len(db.engines), 3)
+                self.assertEqual([engine.pool.checkedin() for engine in db.engines.values()], [2, 2, 2])
+                for engine in db.engines.values():
+                    engine.dispose()
+        self.assertIn('database_ms', app.config['STARTUP_TIMINGS'])
+
+    def test_survives_unreachable_database(self):
+        """Test that warmup logs each unreachable shard and the worker keeps booting."""
+        app = _create_app(DATABASE_URL=UNREACHABLE_URL, SHARD_URLS=UNREACHABLE_URL)
+        app.config['WARMUP_CONNECTIONS'] = 1
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            golf_app.warm_database(app)
+        self.assertIn('Database warmup warning (default)', output.getvalue())
+        self.assertIn('Database warmup warning (shard_1)', output.getvalue())
+        self.assertIn('database_ms', app.config['STARTUP_TIMINGS'])
+
+
+if __name__ == '__main__':
+    unittest.main()